@@ -0,0 +1,202 @@
+import math
+import random
+import time
+
+import numpy as np
+
+from contexts import Context
+from policies import MCTSPolicy, DefaultTreePolicy
+
+
+class NodeArena:
+    """
+    Search tree stored as a struct of arrays. Node statistics live in preallocated NumPy buffers,
+    which grow by doubling, and children of a node occupy a contiguous range of indices, allocated
+    only for legal actions when the node is selected for the first time. Values are stored from
+    the perspective of the player who made the move into the node. A context is materialized
+    only for nodes which have been visited, unvisited children are just slots in the buffers.
+    """
+
+    def __init__(self, root: Context, capacity=1024):
+        self.size = 0
+        self.capacity = capacity
+        self.value = np.zeros(capacity, dtype=np.float64)
+        self.visits = np.zeros(capacity, dtype=np.int32)
+        self.parent = np.full(capacity, -1, dtype=np.int32)
+        self.action = np.full(capacity, -1, dtype=np.int32)
+        self.sign = np.zeros(capacity, dtype=np.int8)
+        self.first_child = np.full(capacity, -1, dtype=np.int32)
+        self.child_count = np.zeros(capacity, dtype=np.int32)
+        self.prior = np.zeros(capacity, dtype=np.float32)
+        self.contexts: list = [None] * capacity
+        self.allocate(1)
+        self.contexts[0] = root
+
+    def grow(self, capacity):
+        for name in ('value', 'visits', 'parent', 'action', 'sign', 'first_child', 'child_count', 'prior'):
+            buffer = getattr(self, name)
+            new_buffer = np.empty(capacity, dtype=buffer.dtype)
+            new_buffer[:self.size] = buffer[:self.size]
+            setattr(self, name, new_buffer)
+        self.contexts += [None] * (capacity - self.capacity)
+        self.capacity = capacity
+
+    def allocate(self, count):
+        start = self.size
+        end = start + count
+        if end > self.capacity:
+            self.grow(max(2 * self.capacity, end))
+        self.value[start:end] = 0
+        self.visits[start:end] = 0
+        self.first_child[start:end] = -1
+        self.child_count[start:end] = 0
+        self.size = end
+        return start, end
+
+    def children(self, node):
+        """
+        Range of children indices of the node, children are allocated on the first call.
+        """
+        start = self.first_child[node]
+        if start < 0:
+            context = self.contexts[node]
+            start, end = self.allocate(len(context.actions))
+            self.parent[start:end] = node
+            self.action[start:end] = context.actions
+            self.sign[start:end] = context.move
+            predictor = getattr(context, 'predictor', None)
+            if predictor is None:
+                self.prior[start:end] = 1 / len(context.actions)
+            else:
+                self.prior[start:end] = [predictor[action] for action in context.actions]
+            self.first_child[node] = start
+            self.child_count[node] = end - start
+            return start, end
+        return start, start + self.child_count[node]
+
+    def context(self, node) -> Context:
+        context = self.contexts[node]
+        if context is None:
+            context = self.contexts[self.parent[node]].of(int(self.action[node]))
+            self.contexts[node] = context
+        return context
+
+
+class ArenaMCTSPolicy(MCTSPolicy):
+    """
+    MCTS over a `NodeArena`, which works with plain `Context` games, UCB bounds of all children
+    of a node are computed as one vectorized expression.
+    """
+
+    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, capacity=1024, metrics=None,
+                 time_limit=None, early_stop=False):
+        super().__init__(rollout_count, c, temperature, use_visits, metrics=metrics, time_limit=time_limit,
+                         early_stop=early_stop)
+        self.capacity = capacity
+
+    def select(self, arena: NodeArena):
+        node = 0
+        path = list()
+        while True:
+            arena.visits[node] += 1
+            context = arena.contexts[node]
+            if context.done:
+                return path, context.reward
+            start, end = arena.children(node)
+            child_visits = arena.visits[start:end]
+            unexplored = np.flatnonzero(child_visits == 0)
+            if unexplored.size > 0:
+                child = start + int(random.choice(unexplored))
+                arena.visits[child] += 1
+                path.append(child)
+                return path, self.evaluate(arena.context(child))
+            bounds = arena.value[start:end] + self.c * np.sqrt(math.log(arena.visits[node]) / child_visits)
+            node = start + int(bounds.argmax())
+            path.append(node)
+
+    @staticmethod
+    def backward(arena: NodeArena, path, reward):
+        nodes = np.array(path, dtype=np.int64)
+        arena.value[nodes] += (reward * arena.sign[nodes] - arena.value[nodes]) / arena.visits[nodes]
+
+    def search(self, arena: NodeArena):
+        """
+        :return: number of rollouts made
+        """
+        start = time.perf_counter()
+        self.evaluate(arena.contexts[0])
+        if self.time_limit is None and not self.early_stop and self.search_metrics is None:
+            for _ in range(self.rollout_count):
+                path, reward = self.select(arena)
+                self.backward(arena, path, reward)
+            return self.rollout_count
+        return self.budgeted_search(arena, start)
+
+    @staticmethod
+    def visit_lead(arena: NodeArena):
+        start, end = arena.children(0)
+        visits = np.sort(arena.visits[start:end])
+        return int(visits[-1] - visits[-2]) if end - start > 1 else int(visits[-1])
+
+    def __call__(self, context: Context):
+        arena = NodeArena(context, self.capacity)
+        self.start_metrics()
+        rollouts = self.search(arena)
+        # every node but the root is created by the search
+        metrics = self.finish_metrics(rollouts, lambda: arena.size, arena.size - 1)
+        start, end = arena.children(0)
+        visited = np.flatnonzero(arena.visits[start:end] > 0) + start
+        actions = arena.action[visited].tolist()
+        action_values = arena.value[visited].tolist()
+        action_visits = arena.visits[visited].tolist()
+        policy_action, info = self.decide(actions, action_values, action_visits)
+        info['rollouts'] = rollouts
+        info['nodes'] = arena.size
+        if metrics is not None:
+            info['metrics'] = metrics
+        return policy_action, info
+
+
+class ArenaPUCTPolicy(ArenaMCTSPolicy):
+
+    def select(self, arena: NodeArena):
+        node = 0
+        path = list()
+        while True:
+            arena.visits[node] += 1
+            context = arena.contexts[node]
+            if context.done:
+                return path, context.reward
+            start, end = arena.children(node)
+            bounds = arena.value[start:end] + self.c * arena.prior[start:end] * math.sqrt(arena.visits[node]) / (arena.visits[start:end] + 1)
+            node = start + int(bounds.argmax())
+            path.append(node)
+            if arena.visits[node] == 0:
+                arena.visits[node] += 1
+                return path, self.evaluate(arena.context(node))
+
+    def __call__(self, context: Context):
+        action, info = super().__call__(context)
+        info['policy'] = 'puct'
+        predictor = getattr(context, 'predictor', None)
+        if predictor is not None:
+            info['predictors'] = {action: predictor[action] for action in context.actions}
+        return action, info
+
+
+class ArenaMCTSDefaultPolicy(ArenaMCTSPolicy, DefaultTreePolicy):
+
+    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, capacity=1024, default_policy=None,
+                 metrics=None, time_limit=None, early_stop=False):
+        ArenaMCTSPolicy.__init__(self, rollout_count, c, temperature, use_visits, capacity, metrics, time_limit,
+                                 early_stop)
+        DefaultTreePolicy.__init__(self, default_policy)
+
+
+class ArenaPUCTDefaultPolicy(ArenaPUCTPolicy, DefaultTreePolicy):
+
+    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, capacity=1024, default_policy=None,
+                 metrics=None, time_limit=None, early_stop=False):
+        ArenaPUCTPolicy.__init__(self, rollout_count, c, temperature, use_visits, capacity, metrics, time_limit,
+                                 early_stop)
+        DefaultTreePolicy.__init__(self, default_policy)
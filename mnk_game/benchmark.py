@@ -0,0 +1,158 @@
+import argparse
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+import tictactoe
+import mnk_game
+import nd_game
+import ultimate
+
+GAMES = [
+    tictactoe.TicTacToe,
+    tictactoe.MNKGame433,
+    tictactoe.MNKGame444,
+    mnk_game.MNKGame333,
+    mnk_game.MNKGame544,
+    mnk_game.MNKGame554,
+    nd_game.TicTacToe3D,
+    nd_game.Qubic,
+    ultimate.UltimateTicTacToe,
+    ultimate.UltimateTicTacToeAlt,
+    ultimate.Ultimate433Game,
+    ultimate.Ultimate444Game
+]
+
+
+def positions(game, count, seed):
+    """
+    Positions which are not final, reached by random games played with a fixed seed,
+    together with a random legal action for every position.
+    """
+    rng = random.Random(seed)
+    samples = list()
+    while len(samples) < count:
+        context = game.new()
+        while not context.done and len(samples) < count:
+            action = rng.choice(context.actions)
+            samples.append((context, action))
+            context = context(action)
+    return samples
+
+
+def primitives(game):
+    """
+    Primitives of the game to measure, every one is a function of a position and an action.
+    """
+    def player_board(context):
+        # noughts board for single board games, crosses super-board for ultimate games
+        return context.board[1] if len(context.board) == 2 else context.board[2]
+
+    operations = {
+        'new': lambda context, action: game.new(),
+        'apply': lambda context, action: context.apply(action),
+        'analyze': lambda context, action: context.analyze(),
+        'call': lambda context, action: context(action),
+        'calculate_reward': lambda context, action: game.calculate_reward(player_board(context))
+    }
+    if getattr(game, 'CELL_LINES', None) is not None:
+        cells = len(game.CELL_LINES)
+        operations['calculate_cell_reward'] = lambda context, action: game.calculate_cell_reward(
+            player_board(context), action % cells)
+    if hasattr(game, 'to_bits'):
+        operations['to_bits'] = lambda context, action: game.to_bits(player_board(context))
+    return operations
+
+
+def measure(operation, samples, min_time):
+    """
+    Runs the operation over all samples until `min_time` seconds elapse, then once more under `tracemalloc`
+    keeping the results, so allocations are the bytes retained by the result of one operation.
+    :return: dictionary with operations per second and bytes allocated per operation
+    """
+    count = 0
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < min_time:
+        for context, action in samples:
+            operation(context, action)
+        count += len(samples)
+        elapsed = time.perf_counter() - start
+    results = [None] * len(samples)
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for idx, (context, action) in enumerate(samples):
+        results[idx] = operation(context, action)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'ops_per_sec': count / elapsed, 'bytes_per_op': (after - before) / len(samples)}
+
+
+def run(games=None, count=1000, seed=0, min_time=0.2):
+    results = dict()
+    for game in games or GAMES:
+        samples = positions(game, count, seed)
+        results[game.__name__] = {name: measure(operation, samples, min_time)
+                                  for name, operation in primitives(game).items()}
+    return {
+        'meta': {'python': platform.python_version(), 'machine': platform.machine(), 'count': count, 'seed': seed},
+        'results': results
+    }
+
+
+def compare(report, baseline, tolerance=0.1):
+    """
+    Primitives which became slower than in the baseline by more than `tolerance`.
+    :return: list of tuples of game, primitive and ratio of the speed to the baseline speed
+    """
+    regressions = list()
+    for game, operations in report['results'].items():
+        for name, stats in operations.items():
+            base = baseline['results'].get(game, dict()).get(name)
+            if base is not None:
+                ratio = stats['ops_per_sec'] / base['ops_per_sec']
+                if ratio < 1 - tolerance:
+                    regressions.append((game, name, ratio))
+    return regressions
+
+
+def print_report(report, baseline=None):
+    for game, operations in report['results'].items():
+        print(game)
+        for name, stats in operations.items():
+            line = f'\t{name:<22}{stats["ops_per_sec"]:>14,.0f} ops/sec{stats["bytes_per_op"]:>10,.0f} B/op'
+            base = baseline['results'].get(game, dict()).get(name) if baseline is not None else None
+            if base is not None:
+                line += f'{stats["ops_per_sec"] / base["ops_per_sec"]:>8.2f}x'
+            print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Microbenchmarks of game primitives')
+    parser.add_argument('--games', nargs='*', help='names of game classes, all by default')
+    parser.add_argument('--count', type=int, default=1000, help='number of positions per game')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds to run every primitive')
+    parser.add_argument('--output', help='JSON file to write the report to')
+    parser.add_argument('--baseline', help='JSON report to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown relative to the baseline')
+    args = parser.parse_args()
+
+    games = [game for game in GAMES if args.games is None or game.__name__ in args.games]
+    report = run(games, args.count, args.seed, args.min_time)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_report(report, baseline)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        for game, name, ratio in regressions:
+            print(f'regression: {game}.{name} runs at {ratio:.2f} of the baseline speed')
+        if len(regressions) > 0:
+            raise SystemExit(1)
@@ -0,0 +1,182 @@
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import time
+
+import tabular_policies as tp
+import train
+from benchmark import GAMES
+from contexts import Context, ContextTree, ContextPredictor
+from policies import MCTSDefaultPolicy, PUCTDefaultPolicy
+
+GAMES_BY_NAME = {game.__name__: game for game in GAMES}
+
+# policy factory of rollout count and the context class its tree is made of
+SEARCH_POLICIES = {
+    'mcts': (lambda rollout_count: MCTSDefaultPolicy(rollout_count), ContextTree),
+    'puct': (lambda rollout_count: PUCTDefaultPolicy(rollout_count), ContextPredictor),
+    'vuct': (lambda rollout_count: tp.TabularVUCTPolicy(rollout_count), ContextTree)
+}
+
+# policy factory, training loop and the context class it is played with
+TRAIN_LOOPS = {
+    'policy_iteration': (lambda: tp.BoltzmannTabularVPolicy(), train.policy_iteration, Context),
+    'q_policy_iteration': (lambda: tp.BoltzmannTabularQPolicy(), train.q_policy_iteration, Context),
+    'direct_policy_iteration': (lambda: MCTSDefaultPolicy(25, default_policy=tp.BoltzmannTabularPiPolicy()),
+                                train.direct_policy_iteration, ContextTree),
+    'puct_v_iteration': (lambda: tp.TabularVTabularPUCTPolicy(25), train.puct_v_iteration, ContextPredictor)
+}
+
+_classes = dict()
+
+
+def node_class(game, base):
+    """
+    Game class with tree nodes of the base class, like `TicTacToeTree` for `TicTacToe` and `ContextTree`.
+    """
+    if base is Context:
+        return game
+    cls = _classes.get((game, base))
+    if cls is None:
+        cls = type(f'{game.__name__}{base.__name__[len("Context"):]}', (base, game), dict())
+        _classes[(game, base)] = cls
+    return cls
+
+
+def peak_rss():
+    """
+    Peak resident set size of the process in megabytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def search_scenario(policy_name, game_name, rollout_count, moves, seed):
+    random.seed(seed)
+    factory, base = SEARCH_POLICIES[policy_name]
+    game = node_class(GAMES_BY_NAME[game_name], base)
+    policy = factory(rollout_count)
+    start_rss = peak_rss()
+    context = game.new()
+    times = list()
+    nodes = list()
+    while len(times) < moves and not context.done:
+        size = context.size()
+        start = time.perf_counter()
+        action, _ = policy(context)
+        times.append(time.perf_counter() - start)
+        nodes.append(context.size() - size)
+        context = context(action)
+    tables = train.policy_tables(policy)
+    return {
+        'policy': policy_name,
+        'game': game_name,
+        'rollout_count': rollout_count,
+        'moves': len(times),
+        'time_per_move': sum(times) / len(times),
+        'rollouts_per_sec': rollout_count * len(times) / sum(times),
+        'nodes_per_move': sum(nodes) / len(nodes),
+        'table_size': sum(len(table) for table in tables),
+        'peak_rss_mb': peak_rss(),
+        'rss_growth_mb': peak_rss() - start_rss
+    }
+
+
+def train_scenario(loop_name, game_name, batch_size, iterations, seed):
+    random.seed(seed)
+    factory, loop, base = TRAIN_LOOPS[loop_name]
+    game = node_class(GAMES_BY_NAME[game_name], base)
+    policy = factory()
+    start_rss = peak_rss()
+    start = time.perf_counter()
+    loop(policy, game, batch_size * iterations, batch_size, 0.1)
+    elapsed = time.perf_counter() - start
+    tables = train.policy_tables(policy)
+    return {
+        'loop': loop_name,
+        'game': game_name,
+        'batch_size': batch_size,
+        'iterations': iterations,
+        'time_per_iteration': elapsed / iterations,
+        'games_per_sec': batch_size * iterations / elapsed,
+        'table_size': sum(len(table) for table in tables),
+        'peak_rss_mb': peak_rss(),
+        'rss_growth_mb': peak_rss() - start_rss
+    }
+
+
+def isolated(scenario, *args):
+    """
+    Runs a scenario in a fresh process, so the peak RSS belongs to the scenario alone.
+    """
+    with multiprocessing.Pool(1) as pool:
+        return pool.apply(scenario, args)
+
+
+def run(games, rollout_counts, batch_sizes, moves=4, iterations=4, seed=0, policies=None, loops=None):
+    search = list()
+    for policy_name in policies or SEARCH_POLICIES:
+        for game_name in games:
+            for rollout_count in rollout_counts:
+                search.append(isolated(search_scenario, policy_name, game_name, rollout_count, moves, seed))
+    training = list()
+    for loop_name in loops or TRAIN_LOOPS:
+        for game_name in games:
+            for batch_size in batch_sizes:
+                training.append(isolated(train_scenario, loop_name, game_name, batch_size, iterations, seed))
+    return {
+        'meta': {'python': platform.python_version(), 'machine': platform.machine(), 'seed': seed,
+                 'moves': moves, 'iterations': iterations},
+        'search': search,
+        'train': training
+    }
+
+
+def curves(records, series_keys, parameter, metrics):
+    """
+    Groups records into scaling curves, one per combination of series keys.
+    :return: dictionary mapping a series name to the list of (parameter, metrics...) points
+    """
+    series = dict()
+    for record in records:
+        name = ' '.join(str(record[key]) for key in series_keys)
+        series.setdefault(name, list()).append((record[parameter],) + tuple(record[metric] for metric in metrics))
+    return series
+
+
+def print_report(report):
+    print('search: rollout_count, rollouts/sec, sec/move, nodes/move, peak RSS MB')
+    for name, points in curves(report['search'], ('policy', 'game'), 'rollout_count',
+                               ('rollouts_per_sec', 'time_per_move', 'nodes_per_move', 'peak_rss_mb')).items():
+        print(name)
+        for rollout_count, speed, move_time, nodes, rss in points:
+            print(f'\t{rollout_count:>8}{speed:>12,.0f}{move_time:>10.3f}{nodes:>10,.0f}{rss:>10.1f}')
+    print('train: batch_size, games/sec, sec/iteration, table size, peak RSS MB')
+    for name, points in curves(report['train'], ('loop', 'game'), 'batch_size',
+                               ('games_per_sec', 'time_per_iteration', 'table_size', 'peak_rss_mb')).items():
+        print(name)
+        for batch_size, speed, iteration_time, size, rss in points:
+            print(f'\t{batch_size:>8}{speed:>12,.1f}{iteration_time:>10.3f}{size:>10,}{rss:>10.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search and training throughput benchmarks')
+    parser.add_argument('--games', nargs='*', default=['TicTacToe', 'MNKGame444', 'MNKGame554', 'Qubic'])
+    parser.add_argument('--policies', nargs='*', choices=list(SEARCH_POLICIES))
+    parser.add_argument('--loops', nargs='*', choices=list(TRAIN_LOOPS))
+    parser.add_argument('--rollouts', nargs='*', type=int, default=[100, 400, 1600])
+    parser.add_argument('--batch-sizes', nargs='*', type=int, default=[25, 100])
+    parser.add_argument('--moves', type=int, default=4, help='moves searched per scenario')
+    parser.add_argument('--iterations', type=int, default=4, help='training iterations per scenario')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file to write the report to')
+    args = parser.parse_args()
+
+    report = run(args.games, args.rollouts, args.batch_sizes, args.moves, args.iterations, args.seed,
+                 args.policies, args.loops)
+    print_report(report)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
@@ -1,9 +1,151 @@
+from collections.abc import Sequence
+
+
+class History:
+    """
+    Persistent list of actions made from the initial position. A history shares all but the last action
+    with the history of the parent context, so extending it takes O(1) time and memory,
+    the last action and the length are available in O(1), and it becomes a list only on demand.
+    """
+
+    __slots__ = ('parent', 'action', 'length')
+
+    def __init__(self, parent=None, action=None):
+        self.parent = parent
+        self.action = action
+        self.length = 0 if parent is None else parent.length + 1
+
+    @classmethod
+    def of(cls, actions):
+        return cls() + actions
+
+    def to_list(self):
+        actions = list()
+        history = self
+        while history.length > 0:
+            actions.append(history.action)
+            history = history.parent
+        actions.reverse()
+        return actions
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __getitem__(self, index):
+        if index == -1 and self.length > 0:
+            return self.action
+        return self.to_list()[index]
+
+    def __add__(self, actions):
+        history = self
+        for action in actions:
+            history = History(history, action)
+        return history
+
+    def __radd__(self, actions):
+        return list(actions) + self.to_list()
+
+    def __eq__(self, other):
+        if isinstance(other, History):
+            return self.length == other.length and self.to_list() == other.to_list()
+        if isinstance(other, Sequence):
+            return self.to_list() == list(other)
+        return NotImplemented
+
+    # unhashable like the list of actions it replaces
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.to_list())
+
+
+class BitActions(Sequence):
+    """
+    Actions given by the set bits of an integer mask, the number of actions is the popcount of the mask,
+    membership is a bit test, and the list of actions is built only when the actions are iterated or indexed,
+    from per-byte tables of set bits.
+    """
+
+    __slots__ = ('mask', 'actions')
+
+    BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+    def __init__(self, mask):
+        self.mask = mask
+        self.actions = None
+
+    def to_list(self):
+        if self.actions is None:
+            actions = list()
+            mask = self.mask
+            offset = 0
+            while mask:
+                byte = mask & 0xff
+                if byte:
+                    actions += [offset + bit for bit in self.BYTE_BITS[byte]]
+                mask >>= 8
+                offset += 8
+            self.actions = actions
+        return self.actions
+
+    def __len__(self):
+        return self.mask.bit_count()
+
+    def __bool__(self):
+        return self.mask != 0
+
+    def __contains__(self, action):
+        return isinstance(action, int) and action >= 0 and self.mask >> action & 1 == 1
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __getitem__(self, index):
+        return self.to_list()[index]
+
+    def __radd__(self, actions):
+        return list(actions) + self.to_list()
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence):
+            return len(self) == len(other) and self.to_list() == list(other)
+        return NotImplemented
+
+    # unhashable like the list of actions it replaces
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.to_list())
+
+
 class Context:
 
-    def __init__(self, board, history: list | None = None):
+    # lazy contexts analyze the position on the first access to reward, done, move or actions
+    LAZY = False
+
+    # source of children with known analysis, like transitions.TransitionCache or transitions.GameGraph,
+    # used only by the class it was made for, other classes inheriting the attribute ignore it
+    transitions = None
+
+    def __init__(self, board, history: History | list | None = None, analysis: tuple | None = None):
         self.board = board
-        self.history = history or list()
-        self.reward, self.done, self.move, self.actions = self.analyze()
+        self.history = history if isinstance(history, History) else History.of(history or ())
+        if analysis is not None:
+            self.reward, self.done, self.move, self.actions = analysis
+        elif not self.LAZY:
+            self.reward, self.done, self.move, self.actions = self.analyze()
+
+    def __getattr__(self, name):
+        if name in ('reward', 'done', 'move', 'actions'):
+            self.reward, self.done, self.move, self.actions = self.analyze()
+            return self.__dict__[name]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
 
     @classmethod
     def new(cls):
@@ -19,39 +161,132 @@ class Context:
     def apply(self, action):
         raise NotImplementedError
 
+    @classmethod
+    def position_key(cls, board, last_action):
+        """
+        Key identifying the position reached by the last action, positions with the same key
+        are the same regardless of the move order.
+        """
+        return board
+
+    def key(self):
+        """
+        Key of this position, see `position_key`.
+        """
+        return self.position_key(self.board, self.history[-1] if self.history else None)
+
     def render(self):
         raise NotImplementedError
 
     def __call__(self, action):
+        transitions = self.transitions
+        if transitions is not None and transitions.game is type(self):
+            return transitions.child(self, action)
         board = self.apply(action)
         return type(self)(board, self.history + [action])
 
+    def next_board(self, action):
+        """
+        Board after the action, taken from the transitions if they are set for this class.
+        """
+        transitions = self.transitions
+        if transitions is not None and transitions.game is type(self):
+            return transitions.next_board(self, action)
+        return self.apply(action)
+
+    def of(self, action):
+        return Context.__call__(self, action)
+
 
 class ContextTree(Context):
 
-    def __init__(self, board, history: list | None = None):
-        super().__init__(board, history)
+    # pending rollouts of tree-parallel search through the node, see parallel.TreeParallelMCTSPolicy
+    virtual_losses = 0
+
+    # number of children created by all trees, counted for search metrics
+    created = 0
+
+    def __init__(self, board, history: History | list | None = None, analysis: tuple | None = None):
+        super().__init__(board, history, analysis)
         self.parent: ContextTree | None = None
         self.value = 0
         self.visits = 0
         self.children: list = [None] * self.num_actions()
+        self.transpositions: dict | None = None
 
     def __call__(self, action):
         child = self.children[action]
         if child is None:
-            child = Context.__call__(self, action)
-            child.parent = self
+            if self.transpositions is None:
+                child = Context.__call__(self, action)
+                child.parent = self
+                ContextTree.created += 1
+            else:
+                board = self.apply(action)
+                key = self.position_key(board, action)
+                child = self.transpositions.get(key)
+                if child is None:
+                    child = type(self)(board, self.history + [action])
+                    child.parent = self
+                    child.transpositions = self.transpositions
+                    self.transpositions[key] = child
+                    ContextTree.created += 1
             self.children[action] = child
         return child
 
-    def of(self, action):
-        return Context.__call__(self, action)
+    def share_transpositions(self):
+        """
+        Turns the tree grown from this node into a DAG, children reaching the same position
+        by different move orders become the same node and share its statistics.
+        """
+        if self.transpositions is None:
+            self.transpositions = {self.key(): self}
+        return self.transpositions
+
+    def size(self):
+        """
+        Number of distinct nodes in the tree grown from this node, shared transpositions are counted once.
+        """
+        visited = {id(self)}
+        stack = [self]
+        while stack:
+            for child in stack.pop().children:
+                if child is not None and id(child) not in visited:
+                    visited.add(id(child))
+                    stack.append(child)
+        return len(visited)
+
+    def promote(self):
+        """
+        Makes this node the root of its tree, keeping statistics of its subtree. The parent with all sibling
+        subtrees is detached, so it is freed once the caller drops it, and the transposition store keeps
+        only positions reachable from this node.
+        :return: number of visits inherited from previous searches
+        """
+        self.parent = None
+        if self.transpositions is not None:
+            nodes = {id(self): self}
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                for child in node.children:
+                    if child is not None and id(child) not in nodes:
+                        nodes[id(child)] = child
+                        stack.append(child)
+            # shared nodes may have been created from a discarded branch
+            for node in nodes.values():
+                for child in node.children:
+                    if child is not None and child is not self and id(child.parent) not in nodes:
+                        child.parent = node
+            self.transpositions.clear()
+            self.transpositions.update((node.key(), node) for node in nodes.values())
+        return self.visits
 
 
 class ContextPredictor(ContextTree):
 
-    def __init__(self, board, history: list | None = None):
-        super().__init__(board, history)
+    def __init__(self, board, history: History | list | None = None, analysis: tuple | None = None):
+        super().__init__(board, history, analysis)
         self.predictor = self.uniform_predictor()
 
     @classmethod
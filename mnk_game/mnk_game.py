@@ -12,49 +12,79 @@ class MNKGame(Context):
     X_MOVE = 1
     O_MOVE = -1
 
+    # winning positions as bitmasks, and winning positions through every cell
+    WIN_POSITIONS = None
+    CELL_LINES = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'LINE' in cls.__dict__:
+            cls.WIN_POSITIONS = cls.win_positions()
+            cls.CELL_LINES = [[position for position in cls.WIN_POSITIONS if position >> cell & 1]
+                              for cell in range(cls.num_actions())]
+
+    @classmethod
+    def win_positions(cls):
+        """
+        Winning positions in the order lines were always checked, so a move completing two lines at once
+        highlights the same one: horizontal, vertical, diagonal and anti-diagonal lines, every direction
+        by the first cell of the line, row by row.
+        """
+        positions = list()
+        for d_row, d_column in ((0, 1), (1, 0), (1, -1), (1, 1)):
+            for row in range(cls.HEIGHT):
+                for column in range(cls.WIDTH):
+                    end_row = row + d_row * (cls.LINE - 1)
+                    end_column = column + d_column * (cls.LINE - 1)
+                    if end_row < cls.HEIGHT and 0 <= end_column < cls.WIDTH:
+                        position = 0
+                        for offset in range(cls.LINE):
+                            position |= 1 << (row + d_row * offset) * cls.WIDTH + column + d_column * offset
+                        positions.append(position)
+        return positions
+
     @classmethod
     def new(cls):
-        return cls(((0,) * cls.num_actions(), (0,) * cls.num_actions()))
+        return cls((0, 0))
 
     @classmethod
     def num_actions(cls):
         return cls.WIDTH * cls.HEIGHT
 
+    @classmethod
+    def shape(cls):
+        return cls.WIDTH, cls.HEIGHT
+
     @classmethod
     def calculate_reward(cls, board):
-        # horizontal
-        for row in range(cls.HEIGHT):
-            for column in range(cls.WIDTH - cls.LINE + 1):
-                shift = row * cls.WIDTH + column
-                if sum(board[shift:shift + cls.LINE]) == cls.LINE:
-                    return 1, (shift, 'horizontal')
-        # vertical
-        for row in range(cls.HEIGHT - cls.LINE + 1):
-            for column in range(cls.WIDTH):
-                shift = row * cls.WIDTH + column
-                if sum(board[shift:cls.LINE * cls.WIDTH + shift:cls.WIDTH]) == cls.LINE:
-                    return 1, (shift, 'vertical')
-        # main diagonal
-        for row in range(cls.HEIGHT - cls.LINE + 1):
-            for column in range(cls.WIDTH - cls.LINE + 1):
-                shift = row * cls.WIDTH + column
-                if sum(board[cls.LINE - 1 + shift:cls.LINE - 1 + shift + cls.LINE * (cls.WIDTH - 1):cls.WIDTH - 1]) == cls.LINE:
-                    return 1, (shift, 'diagonal')
-        # anti-diagonal
-        for row in range(cls.HEIGHT - cls.LINE + 1):
-            for column in range(cls.WIDTH - cls.LINE + 1):
-                shift = row * cls.WIDTH + column
-                if sum(board[shift:shift + cls.LINE * (cls.WIDTH + 1):cls.WIDTH + 1]) == cls.LINE:
-                    return 1, (shift, 'anti-diagonal')
+        for position in cls.WIN_POSITIONS:
+            if board & position == position:
+                return 1, position
+        return 0, None
+
+    @classmethod
+    def calculate_cell_reward(cls, board, cell):
+        for position in cls.CELL_LINES[cell]:
+            if board & position == position:
+                return 1, position
         return 0, None
 
     def analyze(self):
         board_x, board_o = self.board
-        x_count = sum(board_x)
-        o_count = sum(board_o)
-
-        reward_x, _ = self.calculate_reward(board_x)
-        reward_o, _ = self.calculate_reward(board_o)
+        x_count = board_x.bit_count()
+        o_count = board_o.bit_count()
+
+        if self.history:
+            # the position before the last move was not final, so only the last move can make a line
+            if x_count == o_count:
+                reward_x = 0
+                reward_o, _ = self.calculate_cell_reward(board_o, self.history[-1])
+            else:
+                reward_x, _ = self.calculate_cell_reward(board_x, self.history[-1])
+                reward_o = 0
+        else:
+            reward_x, _ = self.calculate_reward(board_x)
+            reward_o, _ = self.calculate_reward(board_o)
         reward_o = -reward_o
 
         if x_count == o_count and reward_x == 0:
@@ -66,7 +96,8 @@ class MNKGame(Context):
         else:
             raise ValueError(self.board)
 
-        actions = [idx for idx, (x, o) in enumerate(zip(board_x, board_o)) if x == 0 and o == 0] if reward == 0 else list()
+        board_free = ~(board_x | board_o)
+        actions = [idx for idx in range(self.num_actions()) if board_free >> idx & 1] if reward == 0 else list()
         done = len(actions) == 0
 
         return reward, done, move, actions
@@ -74,25 +105,15 @@ class MNKGame(Context):
     def apply(self, action):
         board_x, board_o = self.board
         if self.move == MNKGame.X_MOVE:
-            new_board_x = list(board_x)
-            new_board_x[action] = 1
-            return tuple(new_board_x), board_o
+            return board_x | 1 << action, board_o
         else:
-            new_board_o = list(board_o)
-            new_board_o[action] = 1
-            return board_x, tuple(new_board_o)
+            return board_x, board_o | 1 << action
 
     def add_win_line(self, cells, board, cell):
-        _, (shift, line) = self.calculate_reward(board)
-        for offset in range(self.LINE):
-            if line == 'horizontal':
-                cells[shift + offset] = cell
-            elif line == 'vertical':
-                cells[shift + offset * self.WIDTH] = cell
-            elif line == 'diagonal':
-                cells[shift + self.LINE - 1 + offset * (self.WIDTH - 1)] = cell
-            elif line == 'anti-diagonal':
-                cells[shift + offset * (self.WIDTH + 1)] = cell
+        _, position = self.calculate_reward(board)
+        for idx in range(self.num_actions()):
+            if position >> idx & 1:
+                cells[idx] = cell
 
     def render(self):
 
@@ -105,7 +126,7 @@ class MNKGame(Context):
                 return Fore.LIGHTBLACK_EX + f'{pos+1:^3}' + Style.RESET_ALL
 
         board_x, board_o = self.board
-        cells = [cell(x, o, pos) for pos, (x, o) in enumerate(zip(board_x, board_o))]
+        cells = [cell(board_x >> pos & 1, board_o >> pos & 1, pos) for pos in range(self.num_actions())]
 
         if self.reward == 1:
             self.add_win_line(cells, board_x, Fore.LIGHTRED_EX + ' # ' + Style.RESET_ALL)
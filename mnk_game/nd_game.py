@@ -1,77 +1,117 @@
+import functools
+import itertools
+import json
+import os
+
 from contexts import ContextTree
 from tictactoe import TicTacToe
 
+# directory of the disk cache of winning lines, set by `MNK_GAME_CACHE` environment variable,
+# without it lines are generated in memory only
+CACHE_DIR = os.environ.get('MNK_GAME_CACHE')
+
+# format of cache files, files of other versions are generated again
+CACHE_VERSION = 1
+
+
+def line_count(size, dimension):
+    return ((size + 2) ** dimension - size ** dimension) // 2
+
+
+def enumerate_lines(size, dimension):
+    """
+    Enumerates all winning lines of `size^dimension` hypercube, there are `((size+2)^dimension - size^dimension) / 2`
+    of them. A line is a direction from `{-1, 0, 1}^dimension` with the first non-zero component equal to 1,
+    and a starting cell on the hypercube border, cell index is `x + size * y + size^2 * z + ...`.
+    :return: list of winning positions as bitmasks
+    """
+    positions = list()
+    for direction in itertools.product((-1, 0, 1), repeat=dimension):
+        steps = [step for step in direction if step != 0]
+        if not steps or steps[0] != 1:
+            continue
+        starts = [range(size) if step == 0 else (0,) if step == 1 else (size - 1,) for step in direction]
+        for start in itertools.product(*starts):
+            position = 0
+            for offset in range(size):
+                cell = sum((coordinate + offset * step) * size ** axis
+                           for axis, (coordinate, step) in enumerate(zip(start, direction)))
+                position |= 1 << cell
+            positions.append(position)
+    return positions
+
+
+def cell_line_indices(positions, num_cells):
+    """
+    Indices of winning positions through every cell, found in one pass over the set bits of the positions.
+    """
+    cell_indices = [list() for _ in range(num_cells)]
+    for line, position in enumerate(positions):
+        while position:
+            bit = position & -position
+            cell_indices[bit.bit_length() - 1].append(line)
+            position ^= bit
+    return cell_indices
+
+
+def load_lines(path, size, dimension):
+    """
+    :return: winning positions and cell line indices from a cache file, or None if the file is missing,
+    of another version or does not hold all lines of the hypercube
+    """
+    try:
+        with open(path) as file:
+            cache = json.load(file)
+        positions = cache['positions']
+        cell_indices = cache['cell_lines']
+        valid = (cache['version'] == CACHE_VERSION and len(positions) == line_count(size, dimension)
+                 and len(cell_indices) == size ** dimension
+                 and all(isinstance(position, int) and position.bit_count() == size for position in positions)
+                 and sum(len(lines) for lines in cell_indices) == size * len(positions))
+        return (positions, cell_indices) if valid else None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def hypercube_lines(size, dimension):
+    """
+    Winning positions of `size^dimension` hypercube game and winning positions through every cell. If `CACHE_DIR`
+    is set, lines are cached on disk there, which pays off only for the largest boards, like `5^4` and `4^5`.
+    :return: tuple of winning positions list and cell lines list
+    """
+    path = os.path.join(CACHE_DIR, f'hypercube_{size}_{dimension}.json') if CACHE_DIR is not None else None
+    cache = load_lines(path, size, dimension) if path is not None else None
+    if cache is None:
+        positions = enumerate_lines(size, dimension)
+        cell_indices = cell_line_indices(positions, size ** dimension)
+        if path is not None:
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                with open(path + '.tmp', 'w') as file:
+                    json.dump({'version': CACHE_VERSION, 'positions': positions, 'cell_lines': cell_indices}, file)
+                os.replace(path + '.tmp', path)
+            except OSError:
+                pass
+    else:
+        positions, cell_indices = cache
+    return positions, [[positions[line] for line in lines] for lines in cell_indices]
+
 
 class TicTacToe3D(TicTacToe):
 
-    DEPTH = 3
-    NUM_ACTIONS = TicTacToe.WIDTH * TicTacToe.HEIGHT * DEPTH
-
-    WIN_POSITIONS = [
-        # level 1
-        #             |           |
-        0b_000_000_000_000_000_000_000_000_111,
-        0b_000_000_000_000_000_000_000_111_000,
-        0b_000_000_000_000_000_000_111_000_000,
-        0b_000_000_000_000_000_000_001_001_001,
-        0b_000_000_000_000_000_000_010_010_010,
-        0b_000_000_000_000_000_000_100_100_100,
-        0b_000_000_000_000_000_000_100_010_001,
-        0b_000_000_000_000_000_000_001_010_100,
-        # level 2
-        #             |           |
-        0b_000_000_000_000_000_111_000_000_000,
-        0b_000_000_000_000_111_000_000_000_000,
-        0b_000_000_000_111_000_000_000_000_000,
-        0b_000_000_000_001_001_001_000_000_000,
-        0b_000_000_000_010_010_010_000_000_000,
-        0b_000_000_000_100_100_100_000_000_000,
-        0b_000_000_000_100_010_001_000_000_000,
-        0b_000_000_000_001_010_100_000_000_000,
-        # level 3
-        #             |           |
-        0b_000_000_111_000_000_000_000_000_000,
-        0b_000_111_000_000_000_000_000_000_000,
-        0b_111_000_000_000_000_000_000_000_000,
-        0b_001_001_001_000_000_000_000_000_000,
-        0b_010_010_010_000_000_000_000_000_000,
-        0b_100_100_100_000_000_000_000_000_000,
-        0b_100_010_001_000_000_000_000_000_000,
-        0b_001_010_100_000_000_000_000_000_000,
-        # vertical
-        #             |           |
-        0b_000_000_001_000_000_001_000_000_001,
-        0b_000_000_010_000_000_010_000_000_010,
-        0b_000_000_100_000_000_100_000_000_100,
-        0b_000_001_000_000_001_000_000_001_000,
-        0b_000_010_000_000_010_000_000_010_000,
-        0b_000_100_000_000_100_000_000_100_000,
-        0b_001_000_000_001_000_000_001_000_000,
-        0b_010_000_000_010_000_000_010_000_000,
-        0b_100_000_000_100_000_000_100_000_000,
-        # xz-diagonal
-        #             |           |
-        0b_000_000_100_000_000_010_000_000_001,
-        0b_000_100_000_000_010_000_000_001_000,
-        0b_100_000_000_010_000_000_001_000_000,
-        0b_000_000_001_000_000_010_000_000_100,
-        0b_000_001_000_000_010_000_000_100_000,
-        0b_001_000_000_010_000_000_100_000_000,
-        # yz-diagonal
-        #             |           |
-        0b_001_000_000_000_001_000_000_000_001,
-        0b_010_000_000_000_010_000_000_000_010,
-        0b_100_000_000_000_100_000_000_000_100,
-        0b_000_000_001_000_001_000_001_000_000,
-        0b_000_000_010_000_010_000_010_000_000,
-        0b_000_000_100_000_100_000_100_000_000,
-        # xyz-diagonal
-        #             |           |
-        0b_100_000_000_000_010_000_000_000_001,
-        0b_001_000_000_000_010_000_000_000_100,
-        0b_000_000_100_000_010_000_001_000_000,
-        0b_000_000_001_000_010_000_100_000_000
-    ]
+    SIZE = 3
+    DIMENSION = 3
+    WIDTH = SIZE
+    HEIGHT = SIZE
+    DEPTH = SIZE
+    NUM_ACTIONS = SIZE ** DIMENSION
+
+    WIN_POSITIONS, CELL_LINES = hypercube_lines(SIZE, DIMENSION)
+
+    @classmethod
+    def shape(cls):
+        return (cls.SIZE,) * cls.DIMENSION
 
     def print_board(self):
         board_x, board_o = self.board
@@ -79,14 +119,19 @@ class TicTacToe3D(TicTacToe):
         _, position_o = self.calculate_reward(board_o)
         cells = self.cells_for_board(board_x, board_o, position_x, position_o, self.actions)
         border_line = '+'.join(['---'] * self.WIDTH)
-        print('+' + '+   +'.join([border_line] * self.DEPTH) + '+')
-        for row in range(self.HEIGHT):
-            table_rows = list()
-            for level in range(self.DEPTH):
-                offset = level * self.WIDTH * self.HEIGHT + row * self.WIDTH
-                table_rows.append('|'.join(cells[offset:offset + self.WIDTH]))
-            print('|' + '|   |'.join(table_rows) + '|')
+        # hypercubes of higher dimensions are printed as a sequence of 3D cubes
+        cube_size = self.WIDTH * self.HEIGHT * self.DEPTH
+        for cube in range(0, self.NUM_ACTIONS, cube_size):
+            if cube > 0:
+                print()
             print('+' + '+   +'.join([border_line] * self.DEPTH) + '+')
+            for row in range(self.HEIGHT):
+                table_rows = list()
+                for level in range(self.DEPTH):
+                    offset = cube + level * self.WIDTH * self.HEIGHT + row * self.WIDTH
+                    table_rows.append('|'.join(cells[offset:offset + self.WIDTH]))
+                print('|' + '|   |'.join(table_rows) + '|')
+                print('+' + '+   +'.join([border_line] * self.DEPTH) + '+')
 
 
 class TicTacToe3DTree(TicTacToe3D, ContextTree):
@@ -94,106 +139,56 @@ class TicTacToe3DTree(TicTacToe3D, ContextTree):
 
 
 class Qubic(TicTacToe3D):
-    WIDTH = 4
-    HEIGHT = 4
-    DEPTH = 4
-    NUM_ACTIONS = WIDTH * HEIGHT * DEPTH
-
-    WIN_POSITIONS = [
-        # level 1
-        #                     |                   |                   |
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_1111,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_1111_0000,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_1111_0000_0000,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_1111_0000_0000_0000,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0001_0001_0001_0001,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0010_0010_0010_0010,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0100_0100_0100_0100,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_1000_1000_1000_1000,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_1000_0100_0010_0001,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0001_0010_0100_1000,
-        # level 2
-        #                     |                   |                   |
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_1111_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_1111_0000_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0000_1111_0000_0000_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_1111_0000_0000_0000_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0001_0001_0001_0001_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0010_0010_0010_0010_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0100_0100_0100_0100_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_1000_1000_1000_1000_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_1000_0100_0010_0001_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_0000_0000_0000_0000_0001_0010_0100_1000_0000_0000_0000_0000,
-        # level 3
-        #                     |                   |                   |
-        0b_0000_0000_0000_0000_0000_0000_0000_1111_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_0000_0000_1111_0000_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_0000_1111_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_1111_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_0001_0001_0001_0001_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_0010_0010_0010_0010_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_0100_0100_0100_0100_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_1000_1000_1000_1000_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_1000_0100_0010_0001_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_0000_0000_0000_0000_0001_0010_0100_1000_0000_0000_0000_0000_0000_0000_0000_0000,
-        # level 4
-        #                     |                   |                   |
-        0b_0000_0000_0000_1111_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_0000_0000_1111_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_0000_1111_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_1111_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_0001_0001_0001_0001_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_0010_0010_0010_0010_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_0100_0100_0100_0100_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_1000_1000_1000_1000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_1000_0100_0010_0001_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000,
-        0b_0001_0010_0100_1000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000_0000,
-        # vertical
-        #                     |                   |                   |
-        0b_0000_0000_0000_0001_0000_0000_0000_0001_0000_0000_0000_0001_0000_0000_0000_0001,
-        0b_0000_0000_0000_0010_0000_0000_0000_0010_0000_0000_0000_0010_0000_0000_0000_0010,
-        0b_0000_0000_0000_0100_0000_0000_0000_0100_0000_0000_0000_0100_0000_0000_0000_0100,
-        0b_0000_0000_0000_1000_0000_0000_0000_1000_0000_0000_0000_1000_0000_0000_0000_1000,
-        0b_0000_0000_0001_0000_0000_0000_0001_0000_0000_0000_0001_0000_0000_0000_0001_0000,
-        0b_0000_0000_0010_0000_0000_0000_0010_0000_0000_0000_0010_0000_0000_0000_0010_0000,
-        0b_0000_0000_0100_0000_0000_0000_0100_0000_0000_0000_0100_0000_0000_0000_0100_0000,
-        0b_0000_0000_1000_0000_0000_0000_1000_0000_0000_0000_1000_0000_0000_0000_1000_0000,
-        0b_0000_0001_0000_0000_0000_0001_0000_0000_0000_0001_0000_0000_0000_0001_0000_0000,
-        0b_0000_0010_0000_0000_0000_0010_0000_0000_0000_0010_0000_0000_0000_0010_0000_0000,
-        0b_0000_0100_0000_0000_0000_0100_0000_0000_0000_0100_0000_0000_0000_0100_0000_0000,
-        0b_0000_1000_0000_0000_0000_1000_0000_0000_0000_1000_0000_0000_0000_1000_0000_0000,
-        0b_0001_0000_0000_0000_0001_0000_0000_0000_0001_0000_0000_0000_0001_0000_0000_0000,
-        0b_0010_0000_0000_0000_0010_0000_0000_0000_0010_0000_0000_0000_0010_0000_0000_0000,
-        0b_0100_0000_0000_0000_0100_0000_0000_0000_0100_0000_0000_0000_0100_0000_0000_0000,
-        0b_1000_0000_0000_0000_1000_0000_0000_0000_1000_0000_0000_0000_1000_0000_0000_0000,
-        # xz diagonal
-        #                     |                   |                   |
-        0b_0000_0000_0000_1000_0000_0000_0000_0100_0000_0000_0000_0010_0000_0000_0000_0001,
-        0b_0000_0000_1000_0000_0000_0000_0100_0000_0000_0000_0010_0000_0000_0000_0001_0000,
-        0b_0000_1000_0000_0000_0000_0100_0000_0000_0000_0010_0000_0000_0000_0001_0000_0000,
-        0b_1000_0000_0000_0000_1000_0000_0000_0000_1000_0000_0000_0000_1000_0000_0000_0000,
-        0b_0000_0000_0000_0001_0000_0000_0000_0010_0000_0000_0000_0100_0000_0000_0000_1000,
-        0b_0000_0000_0001_0000_0000_0000_0010_0000_0000_0000_0100_0000_0000_0000_1000_0000,
-        0b_0000_0001_0000_0000_0000_0010_0000_0000_0000_0100_0000_0000_0000_1000_0000_0000,
-        0b_0001_0000_0000_0000_0100_0000_0000_0000_0100_0000_0000_0000_1000_0000_0000_0000,
-        # yz diagonal
-        #                     |                   |                   |
-        0b_0001_0000_0000_0000_0000_0001_0000_0000_0000_0000_0001_0000_0000_0000_0000_0001,
-        0b_0010_0000_0000_0000_0000_0010_0000_0000_0000_0000_0010_0000_0000_0000_0000_0010,
-        0b_0100_0000_0000_0000_0000_0100_0000_0000_0000_0000_0100_0000_0000_0000_0000_0100,
-        0b_1000_0000_0000_0000_0000_1000_0000_0000_0000_0000_1000_0000_0000_0000_0000_1000,
-        0b_0000_0000_0000_0001_0000_0000_0001_0000_0000_0001_0000_0000_0001_0000_0000_0000,
-        0b_0000_0000_0000_0010_0000_0000_0010_0000_0000_0010_0000_0000_0010_0000_0000_0000,
-        0b_0000_0000_0000_0100_0000_0000_0100_0000_0000_0100_0000_0000_0100_0000_0000_0000,
-        0b_0000_0000_0000_1000_0000_0000_1000_0000_0000_1000_0000_0000_1000_0000_0000_0000,
-        # xyz diagonal
-        #                     |                   |                   |
-        0b_1000_0000_0000_0000_0000_0100_0000_0000_0000_0000_0010_0000_0000_0000_0000_0001,
-        0b_0001_0000_0000_0000_0000_0010_0000_0000_0000_0000_0100_0000_0000_0000_0000_1000,
-        0b_0000_0000_0001_0000_0000_0000_0100_0000_0000_0010_0000_0000_0001_0000_0000_0000,
-        0b_0000_0000_0000_0001_0000_0000_0010_0000_0000_0100_0000_0000_1000_0000_0000_0000
-    ]
+    SIZE = 4
+    DIMENSION = 3
+    WIDTH = SIZE
+    HEIGHT = SIZE
+    DEPTH = SIZE
+    NUM_ACTIONS = SIZE ** DIMENSION
+    WIN_POSITIONS, CELL_LINES = hypercube_lines(SIZE, DIMENSION)
 
 
 class QubicTree(Qubic, ContextTree):
     pass
+
+
+class NDGame53(TicTacToe3D):
+    SIZE = 5
+    DIMENSION = 3
+    WIDTH = SIZE
+    HEIGHT = SIZE
+    DEPTH = SIZE
+    NUM_ACTIONS = SIZE ** DIMENSION
+    WIN_POSITIONS, CELL_LINES = hypercube_lines(SIZE, DIMENSION)
+
+
+class NDGame53Tree(NDGame53, ContextTree):
+    pass
+
+
+class NDGame34(TicTacToe3D):
+    SIZE = 3
+    DIMENSION = 4
+    WIDTH = SIZE
+    HEIGHT = SIZE
+    DEPTH = SIZE
+    NUM_ACTIONS = SIZE ** DIMENSION
+    WIN_POSITIONS, CELL_LINES = hypercube_lines(SIZE, DIMENSION)
+
+
+class NDGame34Tree(NDGame34, ContextTree):
+    pass
+
+
+class NDGame44(TicTacToe3D):
+    SIZE = 4
+    DIMENSION = 4
+    WIDTH = SIZE
+    HEIGHT = SIZE
+    DEPTH = SIZE
+    NUM_ACTIONS = SIZE ** DIMENSION
+    WIN_POSITIONS, CELL_LINES = hypercube_lines(SIZE, DIMENSION)
+
+
+class NDGame44Tree(NDGame44, ContextTree):
+    pass
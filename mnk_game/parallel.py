@@ -0,0 +1,252 @@
+import math
+import multiprocessing
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from contexts import ContextTree
+from policies import Policy, MCTSPolicy, DefaultTreePolicy
+from rollouts import BatchRolloutTreePolicy
+
+
+# policy searched by a worker process of RootParallelMCTSPolicy, sent once when the pool starts
+_worker_policy: MCTSPolicy | None = None
+
+
+def init_root_worker(policy: MCTSPolicy):
+    global _worker_policy
+    _worker_policy = policy
+
+
+def root_search(task):
+    game, board, history, rollout_count, seed = task
+    policy = _worker_policy
+    random.seed(seed)
+    if hasattr(policy, 'reseed'):
+        policy.reseed(seed)
+    start = time.process_time()
+    root = game(board, history)
+    if policy.transpositions:
+        root.share_transpositions()
+    policy.rollout_count = rollout_count
+    rollouts = policy.search(root)
+    statistics = dict()
+    for action in root.actions:
+        child = root.children[action]
+        if child is not None:
+            statistics[action] = (root.move / child.move * child.value, child.visits)
+    return statistics, rollouts, time.process_time() - start
+
+
+class RootParallelMCTSPolicy(Policy):
+    """
+    Root parallelization of an MCTS policy: `workers` processes search independent trees from the same
+    position, splitting the policy's `rollout_count`, and root statistics are merged, visits are summed
+    and values are averaged with visit weights. With the policy's `time_limit` every worker searches until
+    the deadline, and without `rollout_count` the number of rollouts is not limited otherwise. Workers share
+    transpositions within their own trees if the policy does. The policy with its tables is sent to the workers
+    once, when the pool is started on the first move, so the pool must be closed after the policy is changed.
+    The parallelism reported in `info` is the total CPU time of all workers' searches divided by the wall
+    time of the move, it is not a speedup, which is measured against the single-process search by `speedup`.
+    """
+
+    def __init__(self, policy: MCTSPolicy, workers=None):
+        self.policy = policy
+        self.workers = workers or multiprocessing.cpu_count()
+        self.pool = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['pool'] = None
+        return state
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __call__(self, context: ContextTree):
+        start = time.perf_counter()
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers, initializer=init_root_worker, initargs=(self.policy,))
+        rollout_count = self.policy.rollout_count
+        if rollout_count is None:
+            counts = [None] * self.workers
+        else:
+            counts = [rollout_count // self.workers + (1 if worker < rollout_count % self.workers else 0)
+                      for worker in range(self.workers)]
+        tasks = [(type(context), context.board, list(context.history), count, random.getrandbits(64))
+                 for count in counts if count is None or count > 0]
+        values = dict()
+        visits = dict()
+        search_time = 0
+        rollouts = 0
+        for statistics, worker_rollouts, elapsed in self.pool.map(root_search, tasks):
+            search_time += elapsed
+            rollouts += worker_rollouts
+            for action, (value, action_visits) in statistics.items():
+                values[action] = values.get(action, 0) + value * action_visits
+                visits[action] = visits.get(action, 0) + action_visits
+        actions = [action for action in context.actions if visits.get(action, 0) > 0]
+        action_values = [values[action] / visits[action] for action in actions]
+        action_visits = [visits[action] for action in actions]
+        policy_action, info = self.policy.decide(actions, action_values, action_visits)
+        elapsed = time.perf_counter() - start
+        info['policy'] = 'root-parallel ' + info['policy']
+        info['rollouts'] = rollouts
+        info['workers'] = len(tasks)
+        info['elapsed'] = elapsed
+        info['parallelism'] = search_time / elapsed
+        return policy_action, info
+
+
+class TreeParallelMCTSPolicy(MCTSPolicy):
+    """
+    Tree parallelization of MCTS: `workers` threads share one tree. Selection and backpropagation run under
+    a lock, leaf evaluation runs outside of it. Every node on a selected path gets a virtual loss until its
+    rollout is backpropagated, so concurrent threads spread over different paths. Threads run in parallel
+    only while `expand` releases the GIL, for example in NumPy batch rollouts. The budget of `time_limit` and
+    `early_stop` is checked by every thread after each of its rollouts. The parallelism reported in `info`
+    is the total CPU time of the threads divided by the wall time of the search, it is not a speedup,
+    which is measured against the single-threaded search by `speedup`.
+    """
+
+    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, transpositions=False, promote=False,
+                 workers=4, virtual_loss=1, metrics=None, time_limit=None, early_stop=False):
+        super().__init__(rollout_count, c, temperature, use_visits, transpositions, promote, metrics, time_limit,
+                         early_stop)
+        self.workers = workers
+        self.virtual_loss = virtual_loss
+        self.search_info = dict()
+
+    def descend(self, context: ContextTree):
+        path = list()
+        while True:
+            context.visits += 1
+            if context.done:
+                return path, context, False
+            unexplored = [action for action in context.actions if context.children[action] is None]
+            if len(unexplored) > 0:
+                action = random.choice(unexplored)
+                path.append(action)
+                child = context(action)
+                child.virtual_losses += 1
+                if child.visits == 0:
+                    child.visits += 1
+                    return path, child, True
+                context = child
+                continue
+            max_bound = None
+            selected_action = None
+            for action in context.actions:
+                child = context.children[action]
+                child_value = (context.move / child.move) * child.value - self.virtual_loss * child.virtual_losses / child.visits
+                child_bound = child_value + self.c * math.sqrt(math.log(context.visits) / child.visits)
+                if max_bound is None or child_bound > max_bound:
+                    max_bound = child_bound
+                    selected_action = action
+            path.append(selected_action)
+            context = context(selected_action)
+            context.virtual_losses += 1
+
+    @staticmethod
+    def restore(context: ContextTree, path):
+        for action in path:
+            context = context(action)
+            context.virtual_losses -= 1
+
+    def search(self, context: ContextTree):
+        """
+        :return: number of rollouts made
+        """
+        start = time.perf_counter()
+        if context.visits == 0:
+            self.evaluate(context)
+        deadline, max_rollouts = self.budget(start)
+        metrics = self.search_metrics
+        lock = threading.Lock()
+        # rollouts started, rollouts finished and whether the budget is exhausted
+        state = [0, 0, False]
+
+        def worker():
+            thread_start = time.thread_time()
+            while True:
+                with lock:
+                    if state[2] or state[0] >= max_rollouts:
+                        return time.thread_time() - thread_start
+                    state[0] += 1
+                    if metrics is None:
+                        path, leaf, expand = self.descend(context)
+                    else:
+                        select_start = time.perf_counter()
+                        path, leaf, expand = self.descend(context)
+                        metrics['select_time'] += time.perf_counter() - select_start
+                if metrics is None or not expand:
+                    reward = self.expand(leaf) if expand else leaf.reward
+                else:
+                    # timed outside of the lock, added to the metrics under it
+                    expand_start = time.perf_counter()
+                    reward = self.expand(leaf)
+                    expand_time = time.perf_counter() - expand_start
+                with lock:
+                    if metrics is None:
+                        self.backward(context, path, reward)
+                    else:
+                        backward_start = time.perf_counter()
+                        self.backward(context, path, reward)
+                        metrics['backward_time'] += time.perf_counter() - backward_start
+                        metrics['depths'][len(path)] = metrics['depths'].get(len(path), 0) + 1
+                        if expand:
+                            metrics['expand_time'] += expand_time
+                            metrics['expansions'] += 1
+                    self.restore(context, path)
+                    state[1] += 1
+                    if self.exhausted(context, state[1], start, deadline, max_rollouts):
+                        state[2] = True
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            busy = sum(executor.map(lambda _: worker(), range(self.workers)))
+        elapsed = time.perf_counter() - start
+        self.search_info = {'workers': self.workers, 'elapsed': elapsed, 'parallelism': busy / elapsed if elapsed > 0 else 1.}
+        return state[1]
+
+    def __call__(self, context: ContextTree):
+        action, info = super().__call__(context)
+        info.update(self.search_info)
+        return action, info
+
+
+class TreeParallelMCTSDefaultPolicy(TreeParallelMCTSPolicy, DefaultTreePolicy):
+
+    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, default_policy=None, transpositions=False,
+                 promote=False, workers=4, virtual_loss=1, metrics=None, time_limit=None, early_stop=False):
+        TreeParallelMCTSPolicy.__init__(self, rollout_count, c, temperature, use_visits, transpositions, promote,
+                                        workers, virtual_loss, metrics, time_limit, early_stop)
+        DefaultTreePolicy.__init__(self, default_policy)
+
+
+class TreeParallelMCTSBatchRolloutPolicy(TreeParallelMCTSPolicy, BatchRolloutTreePolicy):
+
+    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, batch_size=64, seed=None,
+                 transpositions=False, promote=False, workers=4, virtual_loss=1, metrics=None, time_limit=None,
+                 early_stop=False):
+        TreeParallelMCTSPolicy.__init__(self, rollout_count, c, temperature, use_visits, transpositions, promote,
+                                        workers, virtual_loss, metrics, time_limit, early_stop)
+        BatchRolloutTreePolicy.__init__(self, batch_size, seed)
+
+
+def speedup(parallel_policy: Policy, policy: Policy, game, count=1):
+    """
+    Compares wall time of a parallel policy against the single-threaded one,
+    both make `count` moves from fresh root positions of the game.
+    :return: ratio of the single-threaded time to the parallel time
+    """
+    times = list()
+    for candidate in (policy, parallel_policy):
+        start = time.perf_counter()
+        for _ in range(count):
+            candidate(game.new())
+        times.append(time.perf_counter() - start)
+    return times[0] / times[1]
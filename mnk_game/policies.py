@@ -1,5 +1,6 @@
 import random
 import math
+import time
 
 from contexts import Context, ContextTree, ContextPredictor
 
@@ -77,25 +78,102 @@ class TreePolicy:
         raise NotImplementedError
 
 
-class MCTSPolicy(Policy, TreePolicy):
+class SearchMetrics:
+    """
+    Metrics sink of `MCTSPolicy`, accumulates metrics of every search: number of rollouts, seconds spent
+    in select, expand and backward phases, number of expansions and of nodes created, which differ when
+    selection creates all children of a node like PUCT does, and the histogram of depths of selected paths.
+    Any object with a `record` method taking the metrics of a search may be used instead.
+    """
+
+    PHASES = ('select_time', 'expand_time', 'backward_time')
+
+    def __init__(self):
+        self.searches = 0
+        self.totals = dict()
+        self.depths = dict()
+        self.tree_size = 0
+
+    def record(self, metrics: dict):
+        self.searches += 1
+        for name in ('rollouts', 'expansions', 'new_nodes') + self.PHASES:
+            self.totals[name] = self.totals.get(name, 0) + metrics[name]
+        for depth, count in metrics['depths'].items():
+            self.depths[depth] = self.depths.get(depth, 0) + count
+        self.tree_size = metrics['tree_size']
+
+    def summary(self) -> dict:
+        """
+        :return: dictionary of totals, microseconds per rollout of every phase, mean depth and depth histogram
+        """
+        rollouts = self.totals.get('rollouts', 0)
+        paths = sum(self.depths.values())
+        summary = {'searches': self.searches, **self.totals, 'tree_size': self.tree_size}
+        for phase in self.PHASES:
+            summary[f'{phase[:-len("_time")]}_us_per_rollout'] = 1e6 * self.totals.get(phase, 0) / rollouts if rollouts > 0 else 0.
+        summary['mean_depth'] = sum(depth * count for depth, count in self.depths.items()) / paths if paths > 0 else 0.
+        summary['depths'] = dict(sorted(self.depths.items()))
+        return summary
+
 
-    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False):
+class MCTSPolicy(Policy, TreePolicy):
+    """
+    Search makes `rollout_count` rollouts, or with `time_limit` as many rollouts as fit in `time_limit` seconds,
+    but no more than `rollout_count` unless it is None. With `early_stop` the search stops as soon as
+    the most visited root action can not be overtaken within the remaining budget.
+    """
+
+    # rollouts between checks of early stopping
+    CHECK_INTERVAL = 16
+
+    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, transpositions=False, promote=False,
+                 metrics=None, time_limit=None, early_stop=False):
+        if rollout_count is None and time_limit is None:
+            raise ValueError('either rollout_count or time_limit must be set')
+        if early_stop and not use_visits:
+            raise ValueError('early_stop compares visits of root actions, it requires use_visits')
         self.rollout_count = rollout_count
         self.c = c
         self.temperature = temperature
         self.use_visits = use_visits
+        self.transpositions = transpositions
+        self.promote = promote
+        self.metrics = metrics
+        self.time_limit = time_limit
+        self.early_stop = early_stop
+        # metrics of the running search, collected only when there is a metrics sink
+        self.search_metrics = None
+
+    def evaluate(self, context: ContextTree):
+        """
+        Expands a node visited for the first time, timed when metrics are collected.
+        """
+        metrics = self.search_metrics
+        if metrics is None:
+            return self.expand(context)
+        start = time.perf_counter()
+        reward = self.expand(context)
+        metrics['expand_time'] += time.perf_counter() - start
+        metrics['expansions'] += 1
+        return reward
 
     def select(self, context: ContextTree):
+        path = list()
         while True:
             context.visits += 1
             if context.done:
-                return context.history, context.reward
+                return path, context.reward
             unexplored = [action for action in context.actions if context.children[action] is None]
             if len(unexplored) > 0:
                 action = random.choice(unexplored)
+                path.append(action)
                 child = context(action)
-                child.visits += 1
-                return child.history, self.expand(child)
+                if child.visits == 0:
+                    child.visits += 1
+                    return path, self.evaluate(child)
+                # transposition, the position was already reached by another move order
+                context = child
+                continue
             max_bound = None
             selected_action = None
             for action in context.actions:
@@ -104,30 +182,125 @@ class MCTSPolicy(Policy, TreePolicy):
                 if max_bound is None or child_bound > max_bound:
                     max_bound = child_bound
                     selected_action = action
+            path.append(selected_action)
             context = context(selected_action)
 
     @staticmethod
-    def backward(context, history, reward):
-        for action in history:
+    def backward(context, path, reward):
+        for action in path:
             child = context(action)
             child.value += (reward * child.move - child.value) / child.visits
             context = child
 
-    def __call__(self, context: ContextTree):
+    def search(self, context: ContextTree):
+        """
+        :return: number of rollouts made
+        """
+        start = time.perf_counter()
         if context.visits == 0:
-            self.expand(context)
-        for _ in range(self.rollout_count):
-            history, reward = self.select(context)
-            self.backward(context, history[len(context.history):], reward)
-        actions = list()
-        action_values = list()
-        action_visits = list()
-        for action in context.actions:
-            child: ContextTree = context.children[action]
+            self.evaluate(context)
+        if self.time_limit is None and not self.early_stop and self.search_metrics is None:
+            for _ in range(self.rollout_count):
+                path, reward = self.select(context)
+                self.backward(context, path, reward)
+            return self.rollout_count
+        return self.budgeted_search(context, start)
+
+    def budget(self, start):
+        """
+        :return: deadline and the maximum number of rollouts of a search started at `start`, infinite if not set
+        """
+        deadline = start + self.time_limit if self.time_limit is not None else math.inf
+        max_rollouts = self.rollout_count if self.rollout_count is not None else math.inf
+        return deadline, max_rollouts
+
+    def exhausted(self, context: ContextTree, rollouts, start, deadline, max_rollouts):
+        """
+        Whether the search is over after `rollouts` rollouts. Every `CHECK_INTERVAL` rollouts early stopping compares
+        the visit lead with the remaining budget, which is the smaller of the remaining rollouts and
+        the rollouts expected to fit in the remaining time at the mean speed so far.
+        """
+        if rollouts >= max_rollouts:
+            return True
+        now = time.perf_counter()
+        if now >= deadline:
+            return True
+        if self.early_stop and rollouts > 0 and rollouts % self.CHECK_INTERVAL == 0:
+            remaining = min(max_rollouts - rollouts, (deadline - now) * rollouts / (now - start))
+            return self.visit_lead(context) > remaining
+        return False
+
+    def budgeted_search(self, context: ContextTree, start):
+        """
+        Search checking the budget after every rollout, rollouts are timed when metrics are collected.
+        :return: number of rollouts made
+        """
+        deadline, max_rollouts = self.budget(start)
+        rollouts = 0
+        while not self.exhausted(context, rollouts, start, deadline, max_rollouts):
+            if self.search_metrics is None:
+                path, reward = self.select(context)
+                self.backward(context, path, reward)
+            else:
+                self.timed_rollout(context)
+            rollouts += 1
+        return rollouts
+
+    def timed_rollout(self, context: ContextTree):
+        """
+        Rollout adding time of its phases and depth of its path to the metrics of the search,
+        expansion is timed by `evaluate` and is not counted as selection.
+        """
+        metrics = self.search_metrics
+        expand_time = metrics['expand_time']
+        start = time.perf_counter()
+        path, reward = self.select(context)
+        selected = time.perf_counter()
+        self.backward(context, path, reward)
+        metrics['backward_time'] += time.perf_counter() - selected
+        metrics['select_time'] += selected - start - (metrics['expand_time'] - expand_time)
+        metrics['depths'][len(path)] = metrics['depths'].get(len(path), 0) + 1
+
+    @staticmethod
+    def visit_lead(context: ContextTree):
+        """
+        Difference of visits of the two most visited children.
+        """
+        first = 0
+        second = 0
+        for child in context.children:
             if child is not None:
-                actions.append(action)
-                action_values.append(context.move / child.move * child.value)
-                action_visits.append(child.visits)
+                if child.visits > first:
+                    first, second = child.visits, first
+                elif child.visits > second:
+                    second = child.visits
+        return first - second
+
+    def start_metrics(self):
+        """
+        Starts collecting metrics of a search if there is a metrics sink.
+        """
+        if self.metrics is not None:
+            self.search_metrics = {'expansions': 0, 'select_time': 0., 'expand_time': 0., 'backward_time': 0.,
+                                   'depths': dict()}
+
+    def finish_metrics(self, rollouts, tree_size, new_nodes):
+        """
+        Completes metrics of the search and passes them to the metrics sink.
+        :param tree_size: function returning the size of the searched tree, called only when metrics are collected
+        :param new_nodes: number of nodes created by the search
+        :return: dictionary of metrics of the search, or None if they are not collected
+        """
+        metrics = self.search_metrics
+        if metrics is not None:
+            self.search_metrics = None
+            metrics['rollouts'] = rollouts
+            metrics['new_nodes'] = new_nodes
+            metrics['tree_size'] = tree_size()
+            self.metrics.record(metrics)
+        return metrics
+
+    def decide(self, actions, action_values, action_visits):
         if self.use_visits:
             max_visits = max(action_visits)
             weights = [(visits / max_visits) ** (1 / self.temperature) for visits in action_visits]
@@ -144,17 +317,45 @@ class MCTSPolicy(Policy, TreePolicy):
             'probability': {action: proba for action, proba in zip(actions, action_proba)}
         }
 
+    def __call__(self, context: ContextTree):
+        inherited_visits = context.promote() if self.promote else None
+        if self.transpositions:
+            context.share_transpositions()
+        self.start_metrics()
+        created = ContextTree.created
+        rollouts = self.search(context)
+        metrics = self.finish_metrics(rollouts, context.size, ContextTree.created - created)
+        actions = list()
+        action_values = list()
+        action_visits = list()
+        for action in context.actions:
+            child: ContextTree = context.children[action]
+            if child is not None:
+                actions.append(action)
+                action_values.append(context.move / child.move * child.value)
+                action_visits.append(child.visits)
+        policy_action, info = self.decide(actions, action_values, action_visits)
+        info['rollouts'] = rollouts
+        if inherited_visits is not None:
+            info['inherited_visits'] = inherited_visits
+        if metrics is not None:
+            info['metrics'] = metrics
+        return policy_action, info
+
 
 class PUCTPolicy(MCTSPolicy):
 
-    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False):
-        super().__init__(rollout_count, c, temperature, use_visits)
+    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, transpositions=False, promote=False,
+                 metrics=None, time_limit=None, early_stop=False):
+        super().__init__(rollout_count, c, temperature, use_visits, transpositions, promote, metrics, time_limit,
+                         early_stop)
 
     def select(self, context: ContextPredictor):
+        path = list()
         while True:
             context.visits += 1
             if context.done:
-                return context.history, context.reward
+                return path, context.reward
             max_bound = None
             selected_action = None
             for action in context.actions:
@@ -163,10 +364,11 @@ class PUCTPolicy(MCTSPolicy):
                 if max_bound is None or child_bound > max_bound:
                     max_bound = child_bound
                     selected_action = action
+            path.append(selected_action)
             context = context(selected_action)
             if context.visits == 0:
                 context.visits += 1
-                return context.history, self.expand(context)
+                return path, self.evaluate(context)
 
     def __call__(self, context: ContextPredictor):
         action, info = super().__call__(context)
@@ -189,13 +391,17 @@ class DefaultTreePolicy(TreePolicy):
 
 class MCTSDefaultPolicy(MCTSPolicy, DefaultTreePolicy):
 
-    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, default_policy=None):
-        MCTSPolicy.__init__(self, rollout_count, c, temperature, use_visits)
+    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, default_policy=None, transpositions=False,
+                 promote=False, metrics=None, time_limit=None, early_stop=False):
+        MCTSPolicy.__init__(self, rollout_count, c, temperature, use_visits, transpositions, promote, metrics,
+                            time_limit, early_stop)
         DefaultTreePolicy.__init__(self, default_policy)
 
 
 class PUCTDefaultPolicy(PUCTPolicy, DefaultTreePolicy):
 
-    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, default_policy=None):
-        PUCTPolicy.__init__(self, rollout_count, c, temperature, use_visits)
+    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, default_policy=None, transpositions=False,
+                 promote=False, metrics=None, time_limit=None, early_stop=False):
+        PUCTPolicy.__init__(self, rollout_count, c, temperature, use_visits, transpositions, promote, metrics,
+                            time_limit, early_stop)
         DefaultTreePolicy.__init__(self, default_policy)
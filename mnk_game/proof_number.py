@@ -0,0 +1,184 @@
+import time
+
+from contexts import Context
+
+
+class ProofNumberSearch:
+    """
+    Depth-first proof-number search (df-pn) deciding whether a player wins from a position of any `Context` class.
+    Proof and disproof numbers are kept in phi/delta form, from the perspective of the player to move, in
+    a transposition table keyed by `position_key`. For games played on a single board immediate wins,
+    double threats and positions where every line of the player is blocked are detected with the winning masks,
+    so such positions are decided without expanding them. Search stops after `max_nodes` expanded nodes, and when the table grows
+    over `max_entries` the entries which took the least work to compute are dropped.
+    """
+
+    INFINITY = 1 << 40
+
+    def __init__(self, max_nodes=1000000, max_entries=1000000):
+        self.max_nodes = max_nodes
+        self.max_entries = max_entries
+        self.table = dict()
+        self.game = None
+        self.player = None
+        self.threats = False
+        self.nodes = 0
+        self.collections = 0
+
+    def winning_actions(self, context: Context, board):
+        return [action for action in context.actions if context.calculate_cell_reward(board | 1 << action, action)[0]]
+
+    def outcome(self, context: Context):
+        """
+        Whether the player wins from the position, if it is known without search, None otherwise.
+        """
+        if context.done:
+            return context.reward == self.player
+        if self.threats:
+            board_x, board_o = context.board
+            board, opponent_board = (board_x, board_o) if context.move == context.X_MOVE else (board_o, board_x)
+            if len(self.winning_actions(context, board)) > 0:
+                return context.move == self.player
+            if len(self.winning_actions(context, opponent_board)) > 1:
+                return context.move != self.player
+            # every line is blocked by the other player
+            blocking_board = board_o if self.player == context.X_MOVE else board_x
+            if all(position & blocking_board for position in context.WIN_POSITIONS):
+                return False
+        return None
+
+    def numbers(self, context: Context, outcome):
+        if outcome == (context.move == self.player):
+            return 0, self.INFINITY
+        return self.INFINITY, 0
+
+    def lookup(self, key):
+        entry = self.table.get(key)
+        return (1, 1) if entry is None else (entry[0], entry[1])
+
+    def store(self, key, phi, delta, work):
+        self.table[key] = (phi, delta, work)
+        if len(self.table) > self.max_entries:
+            self.collect()
+
+    def collect(self):
+        works = sorted(entry[2] for entry in self.table.values())
+        threshold = works[len(works) // 2]
+        self.table = {key: entry for key, entry in self.table.items() if entry[2] > threshold}
+        self.collections += 1
+
+    def expand(self, context: Context):
+        children = list()
+        for action in context.actions:
+            child = context.of(action)
+            key = child.key()
+            if key not in self.table:
+                outcome = self.outcome(child)
+                if outcome is not None:
+                    phi, delta = self.numbers(child, outcome)
+                    self.table[key] = (phi, delta, 0)
+            children.append((key, child))
+        return children
+
+    def search(self, context: Context, key, phi_threshold, delta_threshold):
+        self.nodes += 1
+        outcome = self.outcome(context)
+        if outcome is not None:
+            # decided positions are stored without work and may have been dropped from the table
+            phi, delta = self.numbers(context, outcome)
+            self.store(key, phi, delta, 0)
+            return phi, delta
+        start = self.nodes
+        children = self.expand(context)
+        while True:
+            phi = self.INFINITY
+            delta = 0
+            disproven = False
+            best = None
+            best_phi = None
+            best_delta = self.INFINITY
+            second_delta = self.INFINITY
+            for child in children:
+                child_phi, child_delta = self.lookup(child[0])
+                phi = min(phi, child_delta)
+                delta += child_phi
+                disproven |= child_phi >= self.INFINITY
+                if child_delta < best_delta:
+                    second_delta = best_delta
+                    best = child
+                    best_phi = child_phi
+                    best_delta = child_delta
+                elif child_delta < second_delta:
+                    second_delta = child_delta
+            # only a solved child makes the sum infinite, transpositions can inflate it otherwise
+            delta = self.INFINITY if disproven else min(delta, self.INFINITY - 1)
+            if phi >= phi_threshold or delta >= delta_threshold or self.nodes >= self.max_nodes:
+                self.store(key, phi, delta, self.nodes - start + 1)
+                return phi, delta
+            child_phi_threshold = min(self.INFINITY, delta_threshold + best_phi - delta)
+            child_delta_threshold = min(phi_threshold, second_delta + 1)
+            self.search(best[1], best[0], child_phi_threshold, child_delta_threshold)
+
+    def proven(self, context: Context, key):
+        """
+        Whether the player wins from the position according to the table, None if it is not decided.
+        """
+        entry = self.table.get(key)
+        if entry is None:
+            return self.outcome(context)
+        phi, delta, _ = entry
+        if phi != 0 and delta != 0:
+            return None
+        return (phi == 0) == (context.move == self.player)
+
+    def proof_size(self, context: Context, result, visited: set):
+        """
+        Number of distinct positions in the proof (or disproof) tree stored in the table.
+        """
+        key = context.key()
+        if key in visited:
+            return 0
+        visited.add(key)
+        if self.outcome(context) is not None:
+            return 1
+        size = 1
+        children = [(child, self.proven(child, child.key())) for child in map(context.of, context.actions)]
+        if (context.move == self.player) == result:
+            for child, proven in children:
+                if proven == result:
+                    return size + self.proof_size(child, result, visited)
+            return size
+        for child, proven in children:
+            if proven == result:
+                size += self.proof_size(child, result, visited)
+        return size
+
+    def prove(self, context: Context, player=1):
+        """
+        Decides whether the player, 1 for crosses or -1 for noughts, wins from the position,
+        a draw counts as not a win.
+        :return: dictionary with the result, True if the player wins, False if not, None if the budget
+        was exhausted, proof size, number of nodes, nodes per second, table size and elapsed time
+        """
+        start = time.perf_counter()
+        if player != self.player or type(context) is not self.game:
+            self.table.clear()
+        self.game = type(context)
+        self.player = player
+        self.threats = len(context.board) == 2 and getattr(context, 'CELL_LINES', None) is not None
+        self.nodes = 0
+        self.collections = 0
+        phi, delta = self.search(context, context.key(), self.INFINITY, self.INFINITY)
+        result = None
+        if phi == 0 or delta == 0:
+            result = (phi == 0) == (context.move == player)
+        elapsed = time.perf_counter() - start
+        return {
+            'result': result,
+            'proof_size': self.proof_size(context, result, set()) if result is not None else None,
+            'nodes': self.nodes,
+            'nodes_per_second': self.nodes / elapsed if elapsed > 0 else 0.,
+            'table_size': len(self.table),
+            'collections': self.collections,
+            'elapsed': elapsed
+        }
@@ -0,0 +1,151 @@
+from typing import Type
+
+from contexts import Context
+from symmetry import Symmetry, SymmetricTable
+
+
+def enumerate_layers(game: Type[Context], key=None, max_positions=None) -> list:
+    """
+    Enumerates positions reachable from the initial one breadth-first, one layer per ply,
+    boards are mapped by `key` if it is given, for example to their canonical form.
+    Raises ValueError as soon as there are more than `max_positions` positions, if it is given.
+    :return: list of layers, every layer is a list of boards
+    """
+    key = key or (lambda board: board)
+    layers = [[key(game.new().board)]]
+    count = 1
+    while True:
+        layer = dict()
+        for board in layers[-1]:
+            context = game(board)
+            for action in context.actions:
+                layer[key(context.apply(action))] = None
+            if max_positions is not None and count + len(layer) > max_positions:
+                raise ValueError(f'{game.__name__} has more than {max_positions} positions')
+        if len(layer) == 0:
+            return layers
+        count += len(layer)
+        layers.append(list(layer))
+
+
+class Retrograde:
+    """
+    Retrograde analysis of the full state space of a game played on a single board. Positions reachable
+    from the initial one are enumerated breadth-first, one layer per ply, and then exact values are computed
+    backwards from the last layer, so every position is evaluated after all of its children.
+    Values are final rewards under perfect play, 1 if crosses win, -1 if noughts win, 0 for a draw,
+    in the same format as `v_function` and `q_function` tables of tabular policies.
+    With `symmetric` only canonical boards are enumerated and the tables are `SymmetricTable`.
+    Positions are kept in dictionaries, about 200 bytes each, so a game with more than `max_positions` positions
+    is refused: `MNKGame444` has about 10 million positions, but only 1.2 million canonical ones.
+    """
+
+    MAX_POSITIONS = 2000000
+
+    def __init__(self, game: Type[Context], symmetric=False, max_positions=MAX_POSITIONS):
+        if len(game.new().board) != 2:
+            raise ValueError(f'{game.__name__} is not played on a single board')
+        self.game = game
+        self.symmetry = Symmetry.of(game) if symmetric else None
+        try:
+            self.layers = enumerate_layers(game, self.key, max_positions)
+        except ValueError as error:
+            hint = '' if symmetric else ', analyze it with symmetric=True'
+            raise ValueError(f'{error}{hint} or raise max_positions') from None
+        self.values = self.solve()
+
+    def key(self, board):
+        return board if self.symmetry is None else self.symmetry.canonical(board)[0]
+
+    def table(self, table: dict):
+        return table if self.symmetry is None else SymmetricTable(self.game, table)
+
+    def solve(self) -> dict:
+        values = dict()
+        for layer in reversed(self.layers):
+            for board in layer:
+                context = self.game(board)
+                if context.done:
+                    values[board] = context.reward
+                else:
+                    values[board] = context.move * max(context.move * values[self.key(context.apply(action))]
+                                                       for action in context.actions)
+        return values
+
+    def __len__(self):
+        return len(self.values)
+
+    def value(self, board):
+        return self.values[self.key(board)]
+
+    def v_function(self):
+        return self.table(dict(self.values))
+
+    def q_function(self):
+        """
+        Exact action values of every position which is not final, values of illegal actions are 0.
+        """
+        q_function = dict()
+        for board, value in self.values.items():
+            context = self.game(board)
+            if not context.done:
+                action_values = [0] * self.game.num_actions()
+                for action in context.actions:
+                    action_values[action] = self.value(context.apply(action))
+                q_function[board] = action_values
+        return self.table(q_function)
+
+    @staticmethod
+    def errors(differences, covered, total):
+        count = len(differences)
+        return {
+            'count': count,
+            'coverage': covered / total,
+            'mse': sum(difference ** 2 for difference in differences) / count if count > 0 else 0.,
+            'max_error': max(abs(difference) for difference in differences) if count > 0 else 0.
+        }
+
+    def v_error(self, v_function) -> dict:
+        """
+        Errors of a learned state value function on positions it shares with the state space,
+        coverage is the fraction of positions of the state space present in the function.
+        """
+        differences = list()
+        covered = set()
+        for board, value in v_function.items():
+            key = self.key(board)
+            if key in self.values:
+                differences.append(value - self.values[key])
+                covered.add(key)
+        return self.errors(differences, len(covered), len(self.values))
+
+    def q_error(self, q_function) -> dict:
+        """
+        Errors of a learned action value function on legal actions of positions it shares with the state space,
+        coverage is the fraction of positions of the state space which are not final present in the function.
+        """
+        differences = list()
+        covered = set()
+        for board, action_values in q_function.items():
+            key = self.key(board)
+            if key in self.values:
+                context = self.game(board)
+                for action in context.actions:
+                    differences.append(action_values[action] - self.value(context.apply(action)))
+                covered.add(key)
+        total = sum(not self.game(board).done for board in self.values)
+        return self.errors(differences, len(covered), total)
+
+    def agreement(self, policy) -> float:
+        """
+        Fraction of positions which are not final where the policy chooses an optimal action.
+        """
+        count = 0
+        optimal = 0
+        for board, value in self.values.items():
+            context = self.game(board)
+            if not context.done:
+                action, _ = policy(context)
+                count += 1
+                optimal += self.value(context.apply(action)) == value
+        return optimal / count
@@ -0,0 +1,114 @@
+import numpy as np
+
+from contexts import Context
+from policies import TreePolicy, MCTSPolicy, PUCTPolicy
+
+
+class BatchRollout:
+    """
+    Plays a batch of uniformly random games from the same position at once.
+
+    Every playout of the batch is a row of boolean cell planes, one per side, and every
+    winning line keeps a per-playout counter of the side's stones on it. A step places
+    one random stone in every unfinished playout and only updates the counters of the lines
+    through the chosen cells, so the whole batch advances with a few array operations.
+    Works for games whose board is a pair of X and O bitmasks.
+    """
+
+    def __init__(self, game, batch_size=64, seed=None):
+        if len(game.new().board) != 2:
+            raise ValueError(f'{game.__name__} is not played on a single board')
+        self.game = game
+        self.batch_size = batch_size
+        self.random = np.random.default_rng(seed)
+        lines = self.win_lines(game)
+        self.num_cells = game.num_actions()
+        self.incidence = np.zeros((self.num_cells, len(lines)), dtype=np.int8)
+        for idx, line in enumerate(lines):
+            self.incidence[line, idx] = 1
+        self.line_length = np.array([len(line) for line in lines], dtype=np.int8)
+
+    @staticmethod
+    def win_lines(game) -> list:
+        if getattr(game, 'WIN_POSITIONS', None) is not None:
+            return [[cell for cell in range(game.num_actions()) if position >> cell & 1] for position in game.WIN_POSITIONS]
+        raise ValueError(f'{game.__name__} has no winning positions')
+
+    def planes(self, board):
+        board_x, board_o = board
+        plane_x = [board_x >> cell & 1 for cell in range(self.num_cells)]
+        plane_o = [board_o >> cell & 1 for cell in range(self.num_cells)]
+        return np.array(plane_x, dtype=bool), np.array(plane_o, dtype=bool)
+
+    def __call__(self, context: Context) -> np.ndarray:
+        """
+        Plays `batch_size` random games from the context to the end.
+        :return: array of final rewards, 1 if crosses win, -1 if noughts win, 0 for a draw
+        """
+        if context.done:
+            return np.full(self.batch_size, context.reward, dtype=np.int8)
+        plane_x, plane_o = self.planes(context.board)
+        occupied = np.tile(plane_x | plane_o, (self.batch_size, 1))
+        line_counts = {
+            context.X_MOVE: np.tile(plane_x.astype(np.int8) @ self.incidence, (self.batch_size, 1)),
+            context.O_MOVE: np.tile(plane_o.astype(np.int8) @ self.incidence, (self.batch_size, 1))
+        }
+        rewards = np.zeros(self.batch_size, dtype=np.int8)
+        active = np.arange(self.batch_size)
+        move = context.move
+        for _ in range(len(context.actions)):
+            priorities = self.random.random((active.size, self.num_cells))
+            priorities[occupied[active]] = -1
+            cells = priorities.argmax(axis=1)
+            occupied[active, cells] = True
+            counts = line_counts[move]
+            counts[active] += self.incidence[cells]
+            won = (counts[active] == self.line_length).any(axis=1)
+            rewards[active[won]] = move
+            active = active[~won]
+            if active.size == 0:
+                break
+            move = -move
+        return rewards
+
+
+class BatchRolloutTreePolicy(TreePolicy):
+
+    def __init__(self, batch_size=64, seed=None):
+        self.batch_size = batch_size
+        self.seed = seed
+        self.engines = dict()
+
+    def engine(self, game) -> BatchRollout:
+        engine = self.engines.get(game)
+        if engine is None:
+            engine = BatchRollout(game, self.batch_size, self.seed)
+            self.engines[game] = engine
+        return engine
+
+    def reseed(self, seed):
+        self.seed = seed
+        self.engines.clear()
+
+    def expand(self, context: Context):
+        if context.done:
+            return context.reward
+        return float(self.engine(type(context))(context).mean())
+
+
+class MCTSBatchRolloutPolicy(MCTSPolicy, BatchRolloutTreePolicy):
+
+    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, batch_size=64, seed=None,
+                 transpositions=False, promote=False, metrics=None, time_limit=None, early_stop=False):
+        MCTSPolicy.__init__(self, rollout_count, c, temperature, use_visits, transpositions, promote, metrics,
+                            time_limit, early_stop)
+        BatchRolloutTreePolicy.__init__(self, batch_size, seed)
+
+
+class PUCTBatchRolloutPolicy(PUCTPolicy, BatchRolloutTreePolicy):
+
+    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, batch_size=64, seed=None,
+                 transpositions=False, promote=False, metrics=None, time_limit=None, early_stop=False):
+        PUCTPolicy.__init__(self, rollout_count, c, temperature, use_visits, transpositions, promote, metrics,
+                            time_limit, early_stop)
+        BatchRolloutTreePolicy.__init__(self, batch_size, seed)
@@ -1,7 +1,15 @@
 import tabular_policies as tp
 import train
 from policies import RandomPolicy, MCTSDefaultPolicy
+from rollouts import MCTSBatchRolloutPolicy
+from parallel import RootParallelMCTSPolicy
+from solver import SolverPolicy
+from retrograde import Retrograde
+from proof_number import ProofNumberSearch
 from play import play
+from symmetry import SymmetricTable
+from tables import DenseTable, save_policy, load_policy
+from transitions import GameGraph
 import tictactoe
 import mnk_game
 import nd_game
@@ -20,6 +28,37 @@ def fit_q_and_play(game):
     play(policy, game.O_MOVE, game=game, verbose=True)
 
 
+def fit_q_symmetric_and_play(game):
+    policy = tp.EpsilonGreedyTabularQPolicy(epsilon=0.2, q_function=SymmetricTable(game))
+    train.fit_q(policy, game=game, selfplay_count=100000)
+    policy.epsilon = 0.
+    play(policy, game.O_MOVE, game=game, verbose=True)
+
+
+def fit_q_and_benchmark(game):
+    retrograde = Retrograde(game)
+    policy = tp.EpsilonGreedyTabularQPolicy(epsilon=0.2)
+    train.fit_q(policy, game=game, selfplay_count=100000)
+    policy.epsilon = 0.
+    print(retrograde.q_error(policy.q_function))
+    print(f'optimal actions: {retrograde.agreement(policy):.3f}')
+
+
+def fit_q_dense_and_play(game):
+    policy = tp.EpsilonGreedyTabularQPolicy(epsilon=0.2, q_function=DenseTable.q_function(game))
+    train.fit_q(policy, game=game, selfplay_count=500000)
+    policy.epsilon = 0.
+    play(policy, game.O_MOVE, game=game, verbose=True)
+
+
+def fit_q_save_and_play(game, path):
+    policy = tp.EpsilonGreedyTabularQPolicy(epsilon=0.2, q_function=DenseTable.q_function(game))
+    train.fit_q(policy, game=game, selfplay_count=500000)
+    save_policy(policy, game, path)
+    play_policy = load_policy(tp.GreedyTabularQPolicy(), game, path)
+    play(play_policy, game.O_MOVE, game=game, verbose=True)
+
+
 def policy_iteration_and_play(game):
     policy = tp.BoltzmannTabularVPolicy(temperature=0.2)
     history = train.policy_iteration(policy, game=game, selfplay_count=100000, batch_size=25, learning_rate=0.1)
@@ -28,6 +67,19 @@ def policy_iteration_and_play(game):
     play(policy, game.X_MOVE, game=game, verbose=True)
 
 
+def policy_iteration_on_graph_and_play(game):
+    transitions = game.transitions
+    game.transitions = GameGraph(game)
+    try:
+        policy = tp.BoltzmannTabularVPolicy(temperature=0.2)
+        history = train.policy_iteration(policy, game=game, selfplay_count=100000, batch_size=25, learning_rate=0.1)
+        print(history)
+        policy.temperature = 0.1
+        play(policy, game.X_MOVE, game=game, verbose=True)
+    finally:
+        game.transitions = transitions
+
+
 def q_policy_iteration_and_play(game):
     policy = tp.BoltzmannTabularQPolicy(temperature=0.2)
     history = train.q_policy_iteration(policy, game=game, selfplay_count=100000, batch_size=25, learning_rate=0.1)
@@ -41,6 +93,32 @@ def play_mcts(game):
     play(policy, game.O_MOVE, game=game, verbose=False)
 
 
+def play_mcts_batch(game):
+    policy = MCTSBatchRolloutPolicy(rollout_count=5000, c=1, temperature=0.1, use_visits=True, batch_size=64)
+    play(policy, game.O_MOVE, game=game, verbose=False)
+
+
+def play_mcts_root_parallel(game):
+    policy = RootParallelMCTSPolicy(MCTSDefaultPolicy(rollout_count=5000, c=1, temperature=0.1, use_visits=True))
+    try:
+        play(policy, game.O_MOVE, game=game, verbose=False)
+    finally:
+        policy.close()
+
+
+def play_solver(game):
+    policy = SolverPolicy(time_limit=10)
+    play(policy, game.O_MOVE, game=game, verbose=True)
+
+
+def prove_openings(game):
+    search = ProofNumberSearch(max_nodes=1000000)
+    context = game.new()
+    for action in context.actions:
+        result = search.prove(context(action), context.move)
+        print(f'{action + 1}: {result}')
+
+
 def dpi_and_play(game):
     default_policy = tp.BoltzmannTabularPiPolicy()
     mcts_policy = MCTSDefaultPolicy(rollout_count=100, c=1, temperature=0.1, use_visits=True, default_policy=default_policy)
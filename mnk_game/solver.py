@@ -0,0 +1,220 @@
+import math
+import random
+import time
+
+from contexts import Context
+from policies import Policy
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Solver:
+    """
+    Alpha-beta negamax with a transposition table, move ordering and iterative deepening over positions
+    of any `Context` class. Values are from the perspective of the player to move: 1 for a win,
+    0 for a draw and -1 for a loss. A depth-limited search scores positions at the horizon as 0,
+    so a win or a loss is always exact, while a draw is exact only if no horizon was reached.
+    Moves are ordered by the best move from the transposition table, by the history heuristic,
+    and by the number of winning lines through the cell, a move completing a line is played at once,
+    and a threat of the opponent to complete a line leaves only the blocking moves.
+    """
+
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+    # searched to the end, valid for any depth
+    FULL_DEPTH = math.inf
+
+    # deadline is checked every that many nodes
+    CHECK_NODES = 256
+
+    def __init__(self, time_limit=None, max_depth=None):
+        if max_depth is not None and max_depth < 1:
+            raise ValueError(f'max_depth must be at least 1, got {max_depth}')
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.game = None
+        self.table = dict()
+        self.history_scores = None
+        self.line_counts = None
+        self.threats = False
+        self.nodes = 0
+        self.horizon = 0
+        self.deadline = None
+
+    def reset(self, game):
+        self.game = game
+        self.table.clear()
+        self.history_scores = [0] * game.num_actions()
+        cell_lines = getattr(game, 'CELL_LINES', None)
+        if cell_lines is None:
+            self.line_counts = [0] * game.num_actions()
+        else:
+            self.line_counts = [len(cell_lines[action % len(cell_lines)]) for action in range(game.num_actions())]
+        # threats are found directly on bitboards for games played on a single board
+        self.threats = cell_lines is not None and len(game.new().board) == 2
+
+    def winning_actions(self, context: Context, board):
+        return [action for action in context.actions if self.game.calculate_cell_reward(board | 1 << action, action)[0]]
+
+    def forced_actions(self, context: Context):
+        """
+        Threat analysis of a position played on a single board: a move completing a line wins, and if the opponent
+        threatens to complete a line, the only moves to consider are the blocking ones.
+        :return: tuple of the proven value with its action, or None if threats do not decide the position,
+        and the actions to search, or None if the position is decided
+        """
+        board_x, board_o = context.board
+        board, opponent_board = (board_x, board_o) if context.move == context.X_MOVE else (board_o, board_x)
+        wins = self.winning_actions(context, board)
+        if len(wins) > 0:
+            return (1, wins[0]), None
+        blocks = self.winning_actions(context, opponent_board)
+        if len(blocks) > 1:
+            return (-1, blocks[0]), None
+        return None, blocks if len(blocks) > 0 else context.actions
+
+    def order(self, children, table_action):
+        return sorted(children, key=lambda child: (child[0] != table_action,
+                                                   -self.history_scores[child[0]],
+                                                   -self.line_counts[child[0]]))
+
+    def negamax(self, context: Context, depth, alpha, beta):
+        self.nodes += 1
+        if self.deadline is not None and self.nodes % self.CHECK_NODES == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        if context.done:
+            return context.reward * context.move
+        if depth == 0:
+            self.horizon += 1
+            return 0
+
+        key = context.key()
+        entry = self.table.get(key)
+        table_action = None
+        alpha_original = alpha
+        if entry is not None:
+            value, flag, entry_depth, table_action = entry
+            if entry_depth >= depth:
+                if entry_depth != self.FULL_DEPTH:
+                    # the stored value depends on the horizon as well
+                    self.horizon += 1
+                if flag == self.EXACT:
+                    return value
+                elif flag == self.LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+
+        if self.threats:
+            proven, actions = self.forced_actions(context)
+            if proven is not None:
+                value, action = proven
+                self.table[key] = (value, self.EXACT, self.FULL_DEPTH, action)
+                return value
+            children = [(action, None) for action in actions]
+        else:
+            children = [(action, context.of(action)) for action in context.actions]
+            for action, child in children:
+                if child.done and child.reward != 0:
+                    # only the player who made the move can complete a line
+                    self.table[key] = (1, self.EXACT, self.FULL_DEPTH, action)
+                    return 1
+
+        horizon = self.horizon
+        best_value = None
+        best_action = None
+        for action, child in self.order(children, table_action):
+            value = -self.negamax(child or context.of(action), depth - 1, -beta, -alpha)
+            if best_value is None or value > best_value:
+                best_value = value
+                best_action = action
+            alpha = max(alpha, value)
+            if alpha >= beta or value == 1:
+                self.history_scores[action] += depth * depth
+                break
+
+        if best_value <= alpha_original:
+            flag = self.UPPER
+        elif best_value >= beta:
+            flag = self.LOWER
+        else:
+            flag = self.EXACT
+        proven = self.horizon == horizon or best_value == 1 and flag != self.UPPER or best_value == -1 and flag != self.LOWER
+        self.table[key] = (best_value, flag, self.FULL_DEPTH if proven else depth, best_action)
+        return best_value
+
+    def search_root(self, context: Context, depth):
+        """
+        Searches every root move with a window just below the best value found so far,
+        so all moves sharing the best value get their exact values.
+        :return: dictionary of action values, values of worse moves are upper bounds
+        """
+        values = dict()
+        best_value = -2
+        for action, child in self.order([(action, context.of(action)) for action in context.actions], None):
+            value = -self.negamax(child, depth - 1, -2, -(best_value - 1))
+            values[action] = value
+            best_value = max(best_value, value)
+        return values
+
+    def solve(self, context: Context):
+        """
+        Solves the position by iterative deepening until the value is proven, the maximal depth is reached
+        or the time limit expires, in the latter case the result of the last completed iteration is returned.
+        A won position is proven at the shortest depth, so its best actions are the fastest wins.
+        :return: dictionary with the value of the position, best actions, action values,
+        whether the value is exact, the depth of the last completed iteration, number of nodes and elapsed time
+        """
+        start = time.perf_counter()
+        if type(context) is not self.game:
+            self.reset(type(context))
+        self.nodes = 0
+        self.deadline = None
+        result = None
+        if context.done:
+            return {'value': context.reward * context.move, 'actions': list(), 'values': dict(), 'exact': True,
+                    'depth': 0, 'nodes': 0, 'elapsed': 0.}
+        max_depth = len(context.actions) if self.max_depth is None else min(self.max_depth, len(context.actions))
+        for depth in range(1, max_depth + 1):
+            if depth > 1 and self.time_limit is not None:
+                self.deadline = start + self.time_limit
+            self.horizon = 0
+            try:
+                values = self.search_root(context, depth)
+            except SearchTimeout:
+                break
+            value = max(values.values())
+            result = {
+                'value': value,
+                'actions': [action for action in context.actions if values[action] == value],
+                'values': values,
+                'exact': self.horizon == 0 or abs(value) == 1,
+                'depth': depth
+            }
+            if result['exact']:
+                break
+        self.deadline = None
+        result['nodes'] = self.nodes
+        result['elapsed'] = time.perf_counter() - start
+        return result
+
+
+class SolverPolicy(Policy):
+    """
+    Plays one of the best moves found by the solver, values are from the perspective of the player to move.
+    """
+
+    def __init__(self, time_limit=None, max_depth=None):
+        self.solver = Solver(time_limit, max_depth)
+
+    def __call__(self, context: Context):
+        result = self.solver.solve(context)
+        info = {'policy': 'solver'}
+        info.update(result)
+        return random.choice(result['actions']), info
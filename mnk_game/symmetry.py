@@ -0,0 +1,173 @@
+import itertools
+from collections.abc import MutableMapping
+
+import numpy as np
+
+
+class Symmetry:
+    """
+    Symmetry group of a rectangular board of given shape, cell index is `x + width * y + width * height * z + ...`.
+    A symmetry is a permutation of axes of equal size combined with reflections of any axes, this gives 4 symmetries
+    for a rectangle, 8 for a square, 48 for a cube and `2^d d!` for `d`-dimensional hypercube.
+    Every symmetry is stored as a cell permutation, identity is always the first one,
+    and as a table of 8-bit chunk images, so a bitboard is transformed with a few lookups.
+    """
+
+    CHUNK = 8
+
+    _groups = dict()
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.num_cells = 1
+        for size in self.shape:
+            self.num_cells *= size
+        self.permutations = list()
+        dimension = len(self.shape)
+        for axes in itertools.permutations(range(dimension)):
+            if any(self.shape[axis] != self.shape[source] for axis, source in enumerate(axes)):
+                continue
+            for flips in itertools.product((False, True), repeat=dimension):
+                self.permutations.append(self.cell_permutation(axes, flips))
+        self.chunks = [self.chunk_images(permutation) for permutation in self.permutations]
+
+    @classmethod
+    def of(cls, game):
+        shape = game.shape()
+        group = cls._groups.get(shape)
+        if group is None:
+            group = cls(shape)
+            cls._groups[shape] = group
+        return group
+
+    def coordinates(self, cell):
+        coordinates = list()
+        for size in self.shape:
+            coordinates.append(cell % size)
+            cell //= size
+        return coordinates
+
+    def cell(self, coordinates):
+        cell = 0
+        for size, coordinate in zip(reversed(self.shape), reversed(coordinates)):
+            cell = cell * size + coordinate
+        return cell
+
+    def cell_permutation(self, axes, flips):
+        permutation = list()
+        for cell in range(self.num_cells):
+            coordinates = self.coordinates(cell)
+            image = [self.shape[axis] - 1 - coordinates[source] if flip else coordinates[source]
+                     for axis, (source, flip) in enumerate(zip(axes, flips))]
+            permutation.append(self.cell(image))
+        return permutation
+
+    def chunk_images(self, permutation):
+        images = list()
+        for offset in range(0, self.num_cells, self.CHUNK):
+            table = list()
+            for chunk in range(1 << self.CHUNK):
+                image = 0
+                for bit in range(self.CHUNK):
+                    if chunk >> bit & 1 and offset + bit < self.num_cells:
+                        image |= 1 << permutation[offset + bit]
+                table.append(image)
+            images.append(table)
+        return images
+
+    def transform(self, board, symmetry):
+        image = 0
+        for table in self.chunks[symmetry]:
+            image |= table[board & 0xff]
+            board >>= self.CHUNK
+        return image
+
+    def canonical(self, board):
+        """
+        Canonical orientation of a board, which is the smallest image among all symmetries.
+        :return: tuple of canonical board and index of the symmetry mapping the board to it
+        """
+        board_x, board_o = board
+        canonical_board = board
+        canonical_symmetry = 0
+        for symmetry in range(1, len(self.permutations)):
+            image = self.transform(board_x, symmetry), self.transform(board_o, symmetry)
+            if image < canonical_board:
+                canonical_board = image
+                canonical_symmetry = symmetry
+        return canonical_board, canonical_symmetry
+
+    def to_canonical(self, value, symmetry):
+        """
+        Maps per-action values from the original board to its canonical board,
+        action `a` of the original board is action `permutation[a]` of the canonical one.
+        Scalar values are returned as is, tuples are mapped element-wise, NumPy arrays along the last axis.
+        """
+        if symmetry == 0:
+            return value
+        if isinstance(value, np.ndarray) and value.ndim > 0:
+            canonical_value = np.empty_like(value)
+            canonical_value[..., self.permutations[symmetry]] = value
+            return canonical_value
+        if isinstance(value, tuple):
+            return tuple(self.to_canonical(item, symmetry) for item in value)
+        if isinstance(value, list):
+            canonical_value = [None] * len(value)
+            for action, image in enumerate(self.permutations[symmetry]):
+                canonical_value[image] = value[action]
+            return canonical_value
+        return value
+
+    def from_canonical(self, value, symmetry):
+        if symmetry == 0:
+            return value
+        if isinstance(value, np.ndarray) and value.ndim > 0:
+            return value[..., self.permutations[symmetry]]
+        if isinstance(value, tuple):
+            return tuple(self.from_canonical(item, symmetry) for item in value)
+        if isinstance(value, list):
+            return [value[image] for image in self.permutations[symmetry]]
+        return value
+
+
+class SymmetricTable(MutableMapping):
+    """
+    Mapping from boards to values, which stores only canonical boards of given game, so all symmetric positions
+    share one entry. Per-action values, like Q-function rows or policy scores, are stored in canonical action order,
+    and are returned and accepted in the action order of the board used as a key.
+    """
+
+    def __init__(self, game, table=None):
+        if len(game.new().board) != 2:
+            raise ValueError(f'{game.__name__} is not played on a single board')
+        self.symmetry = Symmetry.of(game)
+        self.table = table if table is not None else dict()
+
+    def __getitem__(self, board):
+        canonical_board, symmetry = self.symmetry.canonical(board)
+        return self.symmetry.from_canonical(self.table[canonical_board], symmetry)
+
+    def __setitem__(self, board, value):
+        canonical_board, symmetry = self.symmetry.canonical(board)
+        self.table[canonical_board] = self.symmetry.to_canonical(value, symmetry)
+
+    def __delitem__(self, board):
+        canonical_board, _ = self.symmetry.canonical(board)
+        del self.table[canonical_board]
+
+    def __contains__(self, board):
+        canonical_board, _ = self.symmetry.canonical(board)
+        return canonical_board in self.table
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def __len__(self):
+        return len(self.table)
+
+    def setdefault(self, board, default=None):
+        canonical_board, symmetry = self.symmetry.canonical(board)
+        if canonical_board in self.table:
+            return self.symmetry.from_canonical(self.table[canonical_board], symmetry)
+        self.table[canonical_board] = self.symmetry.to_canonical(default, symmetry)
+        return default
@@ -0,0 +1,360 @@
+import json
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from symmetry import SymmetricTable
+
+
+class BoardRank:
+    """
+    Base-3 rank of a board given as a pair of X and O bitmasks, a cell contributes `3^cell` if it is occupied
+    by crosses and `2 * 3^cell` if it is occupied by noughts, so every board of `n` cells gets a distinct
+    integer below `3^n`. The rank is computed with per-byte tables of contributions of 8 consecutive cells.
+    """
+
+    CHUNK = 8
+
+    _ranks = dict()
+
+    # ranks are stored as 64-bit integers
+    MAX_CELLS = 39
+
+    def __init__(self, num_cells):
+        if num_cells > self.MAX_CELLS:
+            raise ValueError(f'boards of {num_cells} cells can not be ranked')
+        self.num_cells = num_cells
+        self.size = 3 ** num_cells
+        self.chunks = list()
+        for offset in range(0, num_cells, self.CHUNK):
+            table = list()
+            for chunk in range(1 << self.CHUNK):
+                table.append(sum(3 ** (offset + bit) for bit in range(self.CHUNK)
+                                 if chunk >> bit & 1 and offset + bit < num_cells))
+            self.chunks.append(table)
+        self.chunk_arrays = [np.array(table, dtype=np.int64) for table in self.chunks]
+
+    @classmethod
+    def of(cls, game):
+        num_cells = game.num_actions()
+        rank = cls._ranks.get(num_cells)
+        if rank is None:
+            rank = cls(num_cells)
+            cls._ranks[num_cells] = rank
+        return rank
+
+    def __call__(self, board):
+        board_x, board_o = board
+        rank = 0
+        for table in self.chunks:
+            rank += table[board_x & 0xff] + 2 * table[board_o & 0xff]
+            board_x >>= self.CHUNK
+            board_o >>= self.CHUNK
+        return rank
+
+    def ranks(self, boards) -> np.ndarray:
+        """
+        Ranks of a sequence of boards, computed with array lookups.
+        """
+        boards = np.array(boards, dtype=np.uint64).reshape(-1, 2)
+        board_x = boards[:, 0]
+        board_o = boards[:, 1]
+        ranks = np.zeros(len(boards), dtype=np.int64)
+        for offset, table in enumerate(self.chunk_arrays):
+            shift = np.uint64(self.CHUNK * offset)
+            ranks += table[(board_x >> shift) & np.uint64(0xff)] + 2 * table[(board_o >> shift) & np.uint64(0xff)]
+        return ranks
+
+    def unrank(self, rank):
+        board_x = 0
+        board_o = 0
+        for cell in range(self.num_cells):
+            rank, digit = divmod(rank, 3)
+            if digit == 1:
+                board_x |= 1 << cell
+            elif digit == 2:
+                board_o |= 1 << cell
+        return board_x, board_o
+
+
+class DenseTable(MutableMapping):
+    """
+    Mapping from boards to values of the same shape, stored as rows of a NumPy array, which grows by doubling.
+    Boards are ranked by `BoardRank`, and a rank is mapped to its row by a dense index array if all `3^n` ranks
+    fit under `DENSE_LIMIT`, or by a dictionary otherwise. Scalar values are returned as floats and vector values
+    as copies of their rows, because the array is reallocated when it grows, so an updated row is assigned back.
+    Entries are iterated in insertion order, deleting an entry moves the last one into its place.
+    """
+
+    DENSE_LIMIT = 1 << 22
+
+    def __init__(self, game, shape=(), capacity=1024, dtype=np.float32):
+        if len(game.new().board) != 2:
+            raise ValueError(f'{game.__name__} is not played on a single board')
+        self.rank = BoardRank.of(game)
+        self.shape = tuple(shape)
+        self.size = 0
+        self.values = np.zeros((capacity,) + self.shape, dtype=dtype)
+        self.ranks = np.zeros(capacity, dtype=np.int64)
+        self.index = np.full(self.rank.size, -1, dtype=np.int32) if self.rank.size <= self.DENSE_LIMIT else dict()
+
+    @classmethod
+    def v_function(cls, game, capacity=1024):
+        return cls(game, (), capacity)
+
+    @classmethod
+    def q_function(cls, game, capacity=1024):
+        return cls(game, (game.num_actions(),), capacity)
+
+    @classmethod
+    def pi_function(cls, game, capacity=1024):
+        return cls(game, (2, game.num_actions()), capacity)
+
+    @classmethod
+    def from_arrays(cls, game, ranks: np.ndarray, values: np.ndarray):
+        """
+        Table of distinct board ranks and their values, copied in bulk.
+        """
+        table = cls(game, values.shape[1:], max(len(ranks), 1))
+        table.size = len(ranks)
+        table.ranks[:table.size] = ranks
+        table.values[:table.size] = values
+        rows = np.arange(table.size)
+        if isinstance(table.index, dict):
+            table.index.update(zip(table.ranks[:table.size].tolist(), rows.tolist()))
+        else:
+            table.index[table.ranks[:table.size]] = rows
+        return table
+
+    def row(self, rank):
+        if isinstance(self.index, dict):
+            return self.index.get(rank, -1)
+        return int(self.index[rank])
+
+    def append(self, rank):
+        if self.size == len(self.ranks):
+            capacity = 2 * len(self.ranks)
+            self.values = np.concatenate([self.values, np.zeros_like(self.values)])
+            self.ranks = np.concatenate([self.ranks, np.zeros(capacity - len(self.ranks), dtype=np.int64)])
+        row = self.size
+        self.ranks[row] = rank
+        self.index[rank] = row
+        self.size += 1
+        return row
+
+    def value(self, row):
+        return float(self.values[row]) if len(self.shape) == 0 else self.values[row].copy()
+
+    def __getitem__(self, board):
+        row = self.row(self.rank(board))
+        if row < 0:
+            raise KeyError(board)
+        return self.value(row)
+
+    def __setitem__(self, board, value):
+        rank = self.rank(board)
+        row = self.row(rank)
+        if row < 0:
+            row = self.append(rank)
+        self.values[row] = value
+
+    def __delitem__(self, board):
+        rank = self.rank(board)
+        row = self.row(rank)
+        if row < 0:
+            raise KeyError(board)
+        last = self.size - 1
+        if row != last:
+            self.values[row] = self.values[last]
+            self.ranks[row] = self.ranks[last]
+            self.index[int(self.ranks[row])] = row
+        if isinstance(self.index, dict):
+            del self.index[rank]
+        else:
+            self.index[rank] = -1
+        self.size = last
+
+    def __contains__(self, board):
+        return self.row(self.rank(board)) >= 0
+
+    def __iter__(self):
+        for row in range(self.size):
+            yield self.rank.unrank(int(self.ranks[row]))
+
+    def __len__(self):
+        return self.size
+
+    def get(self, board, default=None):
+        row = self.row(self.rank(board))
+        return default if row < 0 else self.value(row)
+
+    def setdefault(self, board, default=None):
+        rank = self.rank(board)
+        row = self.row(rank)
+        if row < 0:
+            row = self.append(rank)
+            self.values[row] = default
+        return self.value(row)
+
+    def rows(self, boards, init=None):
+        """
+        Rows of the boards as an array, missing boards are added with a value returned by `init`.
+        """
+        ranks = self.rank.ranks(boards)
+        if isinstance(self.index, dict):
+            rows = np.fromiter((self.index.get(rank, -1) for rank in ranks.tolist()), dtype=np.int64, count=len(ranks))
+        else:
+            rows = self.index[ranks].astype(np.int64)
+        for idx in np.flatnonzero(rows < 0).tolist():
+            if init is None:
+                raise KeyError(boards[idx])
+            rank = int(ranks[idx])
+            row = self.row(rank)
+            if row < 0:
+                row = self.append(rank)
+                self.values[row] = init()
+            rows[idx] = row
+        return rows
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.ranks.nbytes + (self.index.nbytes if isinstance(self.index, np.ndarray) else 0)
+
+
+class MappedTable(MutableMapping):
+    """
+    Table loaded by `load_table`, sorted ranks and values are memory-mapped read-only, so processes loading
+    the same file share one copy through the page cache, and a board is found by binary search of its rank.
+    Entries added or changed after loading are kept in an in-memory overlay. Vector values of mapped entries are
+    returned as copies of their rows, as by `DenseTable`, so an updated row has to be assigned back to the table,
+    and a table for further training is faster loaded with `mmap=False`.
+    """
+
+    def __init__(self, game, ranks: np.ndarray, values: np.ndarray):
+        self.rank = BoardRank.of(game)
+        self.ranks = ranks
+        self.values = values
+        self.shape = values.shape[1:]
+        self.overlay = dict()
+
+    def row(self, rank):
+        row = int(np.searchsorted(self.ranks, rank))
+        return row if row < len(self.ranks) and self.ranks[row] == rank else -1
+
+    def value(self, row):
+        return float(self.values[row]) if len(self.shape) == 0 else self.values[row].copy()
+
+    def __getitem__(self, board):
+        rank = self.rank(board)
+        if rank in self.overlay:
+            return self.overlay[rank]
+        row = self.row(rank)
+        if row < 0:
+            raise KeyError(board)
+        return self.value(row)
+
+    def __setitem__(self, board, value):
+        self.overlay[self.rank(board)] = value
+
+    def __delitem__(self, board):
+        rank = self.rank(board)
+        if self.row(rank) >= 0:
+            raise TypeError('memory-mapped entries can not be deleted')
+        del self.overlay[rank]
+
+    def __contains__(self, board):
+        rank = self.rank(board)
+        return rank in self.overlay or self.row(rank) >= 0
+
+    def __iter__(self):
+        for rank in self.ranks:
+            if int(rank) not in self.overlay:
+                yield self.rank.unrank(int(rank))
+        for rank in self.overlay:
+            yield self.rank.unrank(rank)
+
+    def __len__(self):
+        return len(self.ranks) + sum(self.row(rank) < 0 for rank in self.overlay)
+
+    def get(self, board, default=None):
+        return self[board] if board in self else default
+
+    def setdefault(self, board, default=None):
+        rank = self.rank(board)
+        if rank in self.overlay:
+            return self.overlay[rank]
+        row = self.row(rank)
+        if row < 0:
+            self.overlay[rank] = default
+            return default
+        return self.value(row)
+
+
+def save_table(table, game, path):
+    """
+    Saves a table to `path.ranks.npy` with sorted board ranks, `path.values.npy` with values
+    in the same order as float32 rows, and `path.json` with the metadata.
+    Dictionaries, `DenseTable`, `MappedTable` and `SymmetricTable` over any of them are supported,
+    a symmetric table is saved with its canonical boards and loaded back as a symmetric one.
+    """
+    symmetric = isinstance(table, SymmetricTable)
+    if symmetric:
+        table = table.table
+    if isinstance(table, DenseTable):
+        ranks = table.ranks[:table.size]
+        values = table.values[:table.size]
+    else:
+        rank = BoardRank.of(game)
+        boards = list(table)
+        ranks = np.array([rank(board) for board in boards], dtype=np.int64)
+        values = np.array([np.asarray(table[board], dtype=np.float32) for board in boards], dtype=np.float32)
+    # the shape of values is lost in an empty array made of a dictionary
+    shape = getattr(table, 'shape', values.shape[1:])
+    order = np.argsort(ranks)
+    np.save(f'{path}.ranks.npy', ranks[order])
+    np.save(f'{path}.values.npy', np.ascontiguousarray(values[order], dtype=np.float32).reshape((len(ranks),) + shape))
+    with open(f'{path}.json', 'w') as file:
+        json.dump({'game': game.__name__, 'count': len(ranks), 'shape': list(shape), 'symmetric': symmetric}, file)
+
+
+def load_table(game, path, mmap=True):
+    """
+    Loads a table saved by `save_table`, memory-mapped read-only by default, or into a `DenseTable` with `mmap=False`.
+    """
+    with open(f'{path}.json') as file:
+        meta = json.load(file)
+    if meta['game'] != game.__name__:
+        raise ValueError(f'{path} holds a table of {meta["game"]}, not {game.__name__}')
+    mmap_mode = 'r' if mmap else None
+    ranks = np.load(f'{path}.ranks.npy', mmap_mode=mmap_mode)
+    values = np.load(f'{path}.values.npy', mmap_mode=mmap_mode).reshape((len(ranks),) + tuple(meta['shape']))
+    table = MappedTable(game, ranks, values) if mmap else DenseTable.from_arrays(game, ranks, values)
+    return SymmetricTable(game, table) if meta['symmetric'] else table
+
+
+TABLE_NAMES = ('q_function', 'v_function', 'pi_function')
+
+
+def policy_table_paths(policy, path):
+    for owner, prefix in ((policy, path), (getattr(policy, 'default_policy', None), f'{path}.default_policy')):
+        for name in TABLE_NAMES:
+            if owner is not None and hasattr(owner, name):
+                yield owner, name, f'{prefix}.{name}'
+
+
+def save_policy(policy, game, path):
+    """
+    Saves tables of a tabular policy and of its default policy, `path.q_function.*` and so on.
+    """
+    for owner, name, table_path in policy_table_paths(policy, path):
+        save_table(getattr(owner, name), game, table_path)
+
+
+def load_policy(policy, game, path, mmap=True):
+    """
+    Replaces tables of a tabular policy and of its default policy with the tables saved by `save_policy`.
+    :return: the policy
+    """
+    for owner, name, table_path in policy_table_paths(policy, path):
+        setattr(owner, name, load_table(game, table_path, mmap))
+    return policy
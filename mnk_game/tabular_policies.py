@@ -7,7 +7,7 @@ from contexts import Context, ContextPredictor
 class TabularQPolicy(policies.ScorePolicy):
 
     def __init__(self, q_function=None, max_init_q=0.01):
-        self.q_function = q_function or dict()
+        self.q_function = q_function if q_function is not None else dict()
         self.max_init_q = max_init_q
 
     def scores(self, context: Context):
@@ -21,13 +21,13 @@ class TabularQPolicy(policies.ScorePolicy):
 class TabularVPolicy(policies.ScorePolicy):
 
     def __init__(self, v_function=None, max_init_value=0.01):
-        self.v_function = v_function or dict()
+        self.v_function = v_function if v_function is not None else dict()
         self.max_init_value = max_init_value
 
     def scores(self, context: Context):
         values = list()
         for action in context.actions:
-            virtual_board = context.apply(action)
+            virtual_board = context.next_board(action)
             value = self.v_function.setdefault(virtual_board, self.init())
             values.append(value * context.move)
         return values
@@ -39,7 +39,7 @@ class TabularVPolicy(policies.ScorePolicy):
 class TabularPiPolicy(policies.ScorePolicy):
 
     def __init__(self, pi_function=None):
-        self.pi_function = pi_function or dict()
+        self.pi_function = pi_function if pi_function is not None else dict()
 
     def scores(self, context: Context):
         _, scores = self.pi_function.setdefault(context.board, self.uniform(context.num_actions()))
@@ -98,9 +98,11 @@ class BoltzmannTabularPiPolicy(policies.BoltzmannPolicy, TabularPiPolicy):
 
 class TabularPUCTPolicy(policies.PUCTPolicy):
 
-    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, pi_function=None):
-        super().__init__(rollout_count, c, temperature, use_visits)
-        self.pi_function = pi_function or dict()
+    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, pi_function=None, transpositions=False,
+                 promote=False, metrics=None, time_limit=None, early_stop=False):
+        super().__init__(rollout_count, c, temperature, use_visits, transpositions, promote, metrics, time_limit,
+                         early_stop)
+        self.pi_function = pi_function if pi_function is not None else dict()
 
     def expand(self, context: ContextPredictor):
         pi, _ = self.pi_function.setdefault(context.board, TabularPiPolicy.uniform(context.num_actions()))
@@ -110,15 +112,17 @@ class TabularPUCTPolicy(policies.PUCTPolicy):
 
 class TabularPUCTDefaultPolicy(TabularPUCTPolicy, policies.DefaultTreePolicy):
 
-    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, pi_function=None, default_policy=None):
-        TabularPUCTPolicy.__init__(self, rollout_count, c, temperature, use_visits, pi_function)
+    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, pi_function=None, default_policy=None,
+                 transpositions=False, promote=False, metrics=None, time_limit=None, early_stop=False):
+        TabularPUCTPolicy.__init__(self, rollout_count, c, temperature, use_visits, pi_function, transpositions, promote,
+                                   metrics, time_limit, early_stop)
         policies.DefaultTreePolicy.__init__(self, default_policy)
 
 
 class TabularVTreePolicy(policies.TreePolicy):
 
     def __init__(self, v_function=None, max_init_value=0.01):
-        self.v_function = v_function or dict()
+        self.v_function = v_function if v_function is not None else dict()
         self.max_init_value = max_init_value
 
     def init(self):
@@ -130,13 +134,17 @@ class TabularVTreePolicy(policies.TreePolicy):
 
 class TabularVUCTPolicy(policies.MCTSPolicy, TabularVTreePolicy):
 
-    def __init__(self, rollout_num, c=1, temperature=1, use_visits=False, v_function=None):
-        policies.MCTSPolicy.__init__(self, rollout_num, c, temperature, use_visits)
+    def __init__(self, rollout_num, c=1, temperature=1, use_visits=False, v_function=None, transpositions=False,
+                 promote=False, metrics=None, time_limit=None, early_stop=False):
+        policies.MCTSPolicy.__init__(self, rollout_num, c, temperature, use_visits, transpositions, promote, metrics,
+                                     time_limit, early_stop)
         TabularVTreePolicy.__init__(self, v_function)
 
 
 class TabularVTabularPUCTPolicy(TabularPUCTPolicy, TabularVTreePolicy):
 
-    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, pi_function=None, v_function=None):
-        TabularPUCTPolicy.__init__(self, rollout_count, c, temperature, use_visits, pi_function)
+    def __init__(self, rollout_count, c=1, temperature=1, use_visits=False, pi_function=None, v_function=None,
+                 transpositions=False, promote=False, metrics=None, time_limit=None, early_stop=False):
+        TabularPUCTPolicy.__init__(self, rollout_count, c, temperature, use_visits, pi_function, transpositions, promote,
+                                   metrics, time_limit, early_stop)
         TabularVTreePolicy.__init__(self, v_function)
@@ -1,6 +1,58 @@
+from functools import cached_property
+
 from colorama import Fore, Style
 
-from contexts import Context, ContextTree, ContextPredictor
+from contexts import BitActions, Context, ContextTree, ContextPredictor
+
+
+class BitmaskLookup:
+    """
+    Tables indexed by every bitmask of a board of up to `MAX_CELLS` cells: the first winning position
+    contained in the bitmask, or 0 if there is none, and the cells of set bits.
+    Tables are built on the first access and shared by games with the same cells and winning positions.
+    """
+
+    MAX_CELLS = 16
+
+    _lookups = dict()
+
+    def __init__(self, num_cells, win_positions):
+        self.num_cells = num_cells
+        self.mask = (1 << num_cells) - 1
+        self.win_positions = win_positions
+
+    @classmethod
+    def of(cls, num_cells, win_positions):
+        if num_cells > cls.MAX_CELLS:
+            return None
+        key = num_cells, tuple(win_positions)
+        lookup = cls._lookups.get(key)
+        if lookup is None:
+            lookup = cls(num_cells, win_positions)
+            cls._lookups[key] = lookup
+        return lookup
+
+    @cached_property
+    def wins(self) -> list:
+        wins = [0] * (self.mask + 1)
+        # positions are assigned in reverse, so the first winning position in the list is kept
+        for position in reversed(self.win_positions):
+            rest = self.mask & ~position
+            # every board containing the position is the position with a submask of the rest of the cells
+            submask = rest
+            while True:
+                wins[position | submask] = position
+                if submask == 0:
+                    break
+                submask = (submask - 1) & rest
+        return wins
+
+    @cached_property
+    def cells(self) -> list:
+        cells = [()]
+        for cell in range(self.num_cells):
+            cells += [board_cells + (cell,) for board_cells in cells]
+        return cells
 
 
 class TicTacToe(Context):
@@ -23,6 +75,23 @@ class TicTacToe(Context):
         0b_001_010_100
     ]
 
+    # winning positions through every cell, only these can be completed by a move to the cell
+    CELL_LINES = None
+
+    # tables of wins and cells of every bitmask, None for boards too large to tabulate
+    LOOKUP: BitmaskLookup | None = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'WIN_POSITIONS' in cls.__dict__ and 'CELL_LINES' not in cls.__dict__:
+            cls.CELL_LINES = cls.cell_lines()
+        if 'WIN_POSITIONS' in cls.__dict__ and 'LOOKUP' not in cls.__dict__:
+            cls.LOOKUP = BitmaskLookup.of(cls.NUM_ACTIONS, cls.WIN_POSITIONS)
+
+    @classmethod
+    def cell_lines(cls):
+        return [[position for position in cls.WIN_POSITIONS if position >> cell & 1] for cell in range(cls.NUM_ACTIONS)]
+
     @classmethod
     def new(cls):
         return cls((0, 0))
@@ -31,32 +100,67 @@ class TicTacToe(Context):
     def num_actions(cls):
         return cls.NUM_ACTIONS
 
+    @classmethod
+    def shape(cls):
+        return cls.WIDTH, cls.HEIGHT
+
     @classmethod
     def calculate_reward(cls, board):
+        if cls.LOOKUP is not None:
+            position = cls.LOOKUP.wins[board]
+            return (1, position) if position else (0, None)
         for position in cls.WIN_POSITIONS:
             if board & position == position:
                 return 1, position
         else:
             return 0, None
 
+    @classmethod
+    def calculate_cell_reward(cls, board, cell):
+        for position in cls.CELL_LINES[cell]:
+            if board & position == position:
+                return 1, position
+        else:
+            return 0, None
+
+    @classmethod
+    def calculate_last_reward(cls, board, cell):
+        """
+        Reward of a board which had no line before the move to the cell, so every line on it goes through the cell.
+        """
+        if cls.LOOKUP is not None:
+            return cls.calculate_reward(board)
+        return cls.calculate_cell_reward(board, cell)
+
+    @classmethod
+    def free_cells(cls, board_x, board_o):
+        if cls.LOOKUP is not None:
+            return list(cls.LOOKUP.cells[~(board_x | board_o) & cls.LOOKUP.mask])
+        return BitActions(~(board_x | board_o) & ((1 << cls.NUM_ACTIONS) - 1))
+
     @classmethod
     def to_bits(cls, board):
-        bits = list()
-        for _ in range(cls.NUM_ACTIONS):
-            bits.append(board % 2)
-            board //= 2
-        return bits
+        return [board >> cell & 1 for cell in range(cls.NUM_ACTIONS)]
 
     def analyze(self):
         board_x, board_o = self.board
-        reward_x, _ = self.calculate_reward(board_x)
-        reward_o, _ = self.calculate_reward(board_o)
+        x_count = board_x.bit_count()
+        o_count = board_o.bit_count()
+
+        if self.history:
+            # the position before the last move was not final, so only the last move can make a line,
+            # and any line on the board of the last player is made by it
+            if x_count == o_count:
+                reward_x = 0
+                reward_o, _ = self.calculate_last_reward(board_o, self.history[-1])
+            else:
+                reward_x, _ = self.calculate_last_reward(board_x, self.history[-1])
+                reward_o = 0
+        else:
+            reward_x, _ = self.calculate_reward(board_x)
+            reward_o, _ = self.calculate_reward(board_o)
         reward_o = -reward_o
 
-        bits_x = self.to_bits(board_x)
-        bits_o = self.to_bits(board_o)
-        x_count = sum(bits_x)
-        o_count = sum(bits_o)
         if x_count == o_count and reward_x == 0:
             move = self.X_MOVE
             reward = reward_o
@@ -66,9 +170,7 @@ class TicTacToe(Context):
         else:
             raise ValueError(self.board)
 
-        board_free = self.to_bits(~(board_x | board_o))
-
-        actions = [idx for idx, pos in enumerate(board_free) if pos == 1] if reward == 0 else list()
+        actions = self.free_cells(board_x, board_o) if reward == 0 else list()
         done = len(actions) == 0
 
         return reward, done, move, actions
@@ -136,6 +238,10 @@ class TicTacToe(Context):
                 print('Draw')
 
 
+TicTacToe.CELL_LINES = TicTacToe.cell_lines()
+TicTacToe.LOOKUP = BitmaskLookup.of(TicTacToe.NUM_ACTIONS, TicTacToe.WIN_POSITIONS)
+
+
 class TicTacToeTree(ContextTree, TicTacToe):
     pass
 
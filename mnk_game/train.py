@@ -1,14 +1,21 @@
 import math
+import multiprocessing
+import random
 from typing import Type
 from tqdm import tqdm
 
+import numpy as np
+
 import tabular_policies as tp
 from policies import MCTSDefaultPolicy
 from contexts import Context, ContextTree, ContextPredictor
+from symmetry import SymmetricTable
+from tables import DenseTable
 
 
 def fit_q(policy: tp.TabularQPolicy, game: Type[Context], selfplay_count):
-    visit_counts = dict()
+    # symmetric boards share a row of a symmetric table, so they share their visit counts as well
+    visit_counts = SymmetricTable(game) if isinstance(policy.q_function, SymmetricTable) else dict()
     progress = tqdm(range(selfplay_count))
     for _ in progress:
         context = game.new()
@@ -18,190 +25,378 @@ def fit_q(policy: tp.TabularQPolicy, game: Type[Context], selfplay_count):
             rollout.append((context.board, action))
             context = context(action)
         for board, action in rollout:
-            action_visit_counts = visit_counts.setdefault(board, [0] * game.num_actions())
+            action_visit_counts = visit_counts.get(board, [0] * game.num_actions())
             action_visit_counts[action] += 1
+            visit_counts[board] = action_visit_counts
             action_rewards = policy.q_function.get(board, policy.init(game.num_actions()))
             action_rewards[action] += (context.reward - action_rewards[action]) / action_visit_counts[action]
             policy.q_function[board] = action_rewards
         progress.set_postfix(size_q=len(policy.q_function))
 
 
+def play_v_games(policy, game: Type[Context], count):
+    dataset = dict()
+    for _ in range(count):
+        context = game.new()
+        rollout = [context.board]
+        while not context.done:
+            action, _ = policy(context)
+            context = context(action)
+            rollout.append(context.board)
+        for board in rollout:
+            dataset.setdefault(board, list()).append(context.reward)
+    return dataset,
+
+
+def play_q_games(policy, game: Type[Context], count):
+    dataset = dict()
+    for _ in range(count):
+        context = game.new()
+        rollout = list()
+        while not context.done:
+            action, _ = policy(context)
+            rollout.append((context.board, action))
+            context = context(action)
+        for board, action in rollout:
+            dataset.setdefault((board, action), list()).append(context.reward)
+    return dataset,
+
+
+def play_pi_games(policy, game: Type[Context], count):
+    v_dataset = dict()
+    pi_dataset = dict()
+    for _ in range(count):
+        context = game.new()
+        rollout = list()
+        while not context.done:
+            action, _ = policy(context)
+            pi_dataset.setdefault(context.board, list()).append(action)
+            rollout.append(context.board)
+            context = context(action)
+        for board in rollout:
+            v_dataset.setdefault(board, list()).append(context.reward)
+    return v_dataset, pi_dataset
+
+
+def table_owners(policy):
+    """
+    Objects holding tables of the policy and of its default policy, with attribute names of the tables.
+    """
+    owners = list()
+    for owner in (policy, getattr(policy, 'default_policy', None)):
+        for name in ('q_function', 'v_function', 'pi_function'):
+            if owner is not None and hasattr(owner, name):
+                owners.append((owner, name))
+    return owners
+
+
+def policy_tables(policy):
+    """
+    Tables of the policy and of its default policy, which are extended with initial values during self-play.
+    """
+    return [getattr(owner, name) for owner, name in table_owners(policy)]
+
+
+class RecordingTable:
+    """
+    Table of a self-play worker, which records keys of entries added by `setdefault`,
+    the only way policies extend their tables during play.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.added = list()
+
+    def setdefault(self, key, default=None):
+        if key in self.table:
+            return self.table[key]
+        self.added.append(key)
+        return self.table.setdefault(key, default)
+
+    def __getitem__(self, key):
+        return self.table[key]
+
+    def __setitem__(self, key, value):
+        self.table[key] = value
+
+    def __contains__(self, key):
+        return key in self.table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+
+# policy of a self-play worker process, sent once when the pool starts
+_worker_policy = None
+
+
+def init_selfplay_worker(policy):
+    global _worker_policy
+    _worker_policy = policy
+    for owner, name in table_owners(policy):
+        setattr(owner, name, RecordingTable(getattr(owner, name)))
+
+
+def selfplay_worker(task):
+    play, game, count, seed, updates = task
+    policy = _worker_policy
+    tables = policy_tables(policy)
+    for table, entries in zip(tables, updates):
+        for key, value in entries:
+            table[key] = value
+    random.seed(seed)
+    if hasattr(policy, 'reseed'):
+        policy.reseed(seed)
+    datasets = play(policy, game, count)
+    new_entries = list()
+    for table in tables:
+        new_entries.append([(key, table[key]) for key in table.added])
+        table.added.clear()
+    return datasets, new_entries
+
+
+class SelfplayPool:
+    """
+    Plays self-play games with the policy, in parallel if there is more than one worker. The policy with its
+    tables is sent to every worker process once, when the pool starts, and every batch sends only the entries
+    changed since the previous batch: entries added by the workers and entries marked as `updated` by
+    the update step. Workers play their shares of games, then datasets of all workers are merged, and entries
+    the workers added to the tables are merged into the policy tables before the update step.
+    """
+
+    def __init__(self, policy, workers=1):
+        self.policy = policy
+        self.workers = workers
+        self.tables = policy_tables(policy)
+        self.changed = [set() for _ in self.tables]
+        self.pool = None
+        if workers > 1:
+            self.pool = multiprocessing.Pool(workers, initializer=init_selfplay_worker, initargs=(policy,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def updated(self, table, keys):
+        """
+        Marks entries of the policy table changed outside of self-play, they are sent to the workers
+        with the next batch.
+        """
+        if self.pool is not None:
+            for tracked, changed in zip(self.tables, self.changed):
+                if tracked is table:
+                    changed.update(keys)
+
+    def selfplay(self, play, game: Type[Context], count):
+        """
+        :return: tuple of datasets, mapping a key to the list of collected targets
+        """
+        if self.pool is None:
+            return play(self.policy, game, count)
+        updates = [[(key, table[key]) for key in changed] for table, changed in zip(self.tables, self.changed)]
+        for changed in self.changed:
+            changed.clear()
+        counts = [count // self.workers + (1 if worker < count % self.workers else 0) for worker in range(self.workers)]
+        tasks = [(play, game, worker_count, random.getrandbits(64), updates) for worker_count in counts if worker_count > 0]
+        merged_datasets = None
+        for datasets, new_entries in self.pool.map(selfplay_worker, tasks):
+            for table, changed, entries in zip(self.tables, self.changed, new_entries):
+                for key, value in entries:
+                    table.setdefault(key, value)
+                    # every worker gets the value which was merged first
+                    changed.add(key)
+            if merged_datasets is None:
+                merged_datasets = datasets
+            else:
+                for merged_dataset, dataset in zip(merged_datasets, datasets):
+                    for key, targets in dataset.items():
+                        merged_dataset.setdefault(key, list()).extend(targets)
+        return merged_datasets
+
+
+def update_v(v_function, dataset, learning_rate, init=None):
+    """
+    Moves state values towards mean rewards of the dataset, as array operations for a `DenseTable`.
+    :return: tuple of the sum of squared errors and the number of rewards
+    """
+    if isinstance(v_function, DenseTable):
+        boards = list(dataset)
+        rows = v_function.rows(boards, init)
+        counts = np.array([len(rewards) for rewards in dataset.values()], dtype=np.float64)
+        sums = np.array([sum(rewards) for rewards in dataset.values()], dtype=np.float64)
+        squares = np.array([sum(reward * reward for reward in rewards) for rewards in dataset.values()], dtype=np.float64)
+        state_values = v_function.values[rows].astype(np.float64)
+        loss = float((squares - 2 * state_values * sums + counts * state_values ** 2).sum())
+        v_function.values[rows] = state_values + learning_rate * (sums / counts - state_values)
+        return loss, int(counts.sum())
+    count = 0
+    loss = 0
+    for board, rewards in dataset.items():
+        state_value = v_function[board] if init is None else v_function.setdefault(board, init())
+        loss += sum((reward - state_value) ** 2 for reward in rewards)
+        count += len(rewards)
+        v_function[board] += learning_rate * (sum(rewards) / len(rewards) - state_value)
+    return loss, count
+
+
+def update_q(q_function, dataset, learning_rate):
+    """
+    Moves action values towards mean rewards of the dataset, as array operations for a `DenseTable`.
+    :return: tuple of the sum of squared errors and the number of rewards
+    """
+    if isinstance(q_function, DenseTable):
+        rows = q_function.rows([board for board, _ in dataset])
+        actions = np.array([action for _, action in dataset], dtype=np.int64)
+        counts = np.array([len(rewards) for rewards in dataset.values()], dtype=np.float64)
+        sums = np.array([sum(rewards) for rewards in dataset.values()], dtype=np.float64)
+        squares = np.array([sum(reward * reward for reward in rewards) for rewards in dataset.values()], dtype=np.float64)
+        action_values = q_function.values[rows, actions].astype(np.float64)
+        loss = float((squares - 2 * action_values * sums + counts * action_values ** 2).sum())
+        q_function.values[rows, actions] = action_values + learning_rate * (sums / counts - action_values)
+        return loss, int(counts.sum())
+    count = 0
+    loss = 0
+    for (board, action), rewards in dataset.items():
+        action_rewards = q_function[board]
+        loss += sum((reward - action_rewards[action]) ** 2 for reward in rewards)
+        count += len(rewards)
+        action_rewards[action] += learning_rate * (sum(rewards) / len(rewards) - action_rewards[action])
+        q_function[board] = action_rewards
+    return loss, count
+
+
+def update_pi(pi_function, dataset, learning_rate):
+    """
+    Moves policy scores towards frequencies of actions of the dataset and recomputes the policy as softmax
+    of the scores, as array operations for a `DenseTable`.
+    :return: tuple of the sum of negative log-likelihoods and the number of actions
+    """
+    if isinstance(pi_function, DenseTable):
+        rows = pi_function.rows(list(dataset))
+        lengths = [len(actions) for actions in dataset.values()]
+        batch = np.repeat(np.arange(len(rows)), lengths)
+        actions = np.fromiter((action for actions in dataset.values() for action in actions), dtype=np.int64, count=len(batch))
+        pi = pi_function.values[rows, 0].astype(np.float64)
+        scores = pi_function.values[rows, 1].astype(np.float64)
+        loss = float(-np.log(pi[batch, actions]).sum())
+        frequencies = np.zeros_like(scores)
+        np.add.at(frequencies, (batch, actions), 1)
+        scores += learning_rate * (frequencies / np.array(lengths, dtype=np.float64)[:, None] - pi)
+        weights = np.exp(scores - scores.max(axis=1, keepdims=True))
+        pi_function.values[rows, 0] = weights / weights.sum(axis=1, keepdims=True)
+        pi_function.values[rows, 1] = scores
+        return loss, len(batch)
+    count = 0
+    loss = 0
+    for board, actions in dataset.items():
+        pi, scores = pi_function[board]
+        loss += -sum(math.log(pi[action]) for action in actions)
+        count += len(actions)
+        scores = [score - learning_rate * p for score, p in zip(scores, pi)]
+        for action in actions:
+            scores[action] += learning_rate / len(actions)
+        max_score = max(scores)
+        weights = [math.exp(score - max_score) for score in scores]
+        stat_sum = sum(weights)
+        pi = [weight / stat_sum for weight in weights]
+        pi_function[board] = pi, scores
+    return loss, count
+
+
 def policy_iteration(policy: tp.TabularVPolicy | tp.TabularVUCTPolicy, game: Type[Context],
-                     selfplay_count, batch_size, learning_rate):
+                     selfplay_count, batch_size, learning_rate, workers=1):
     batch_count = selfplay_count // batch_size
     history = dict()
     progress = tqdm(range(batch_count))
-    for _ in progress:
-        batch_dataset = dict()
-        for _ in range(batch_size):
-            context = game.new()
-            rollout = [context.board]
-            while not context.done:
-                action, _ = policy(context)
-                context = context(action)
-                rollout.append(context.board)
-            for board in rollout:
-                batch_dataset.setdefault(board, list()).append(context.reward)
-        count = 0
-        loss = 0
-        for board, rewards in batch_dataset.items():
-            state_value = policy.v_function.setdefault(board, policy.init())
-            loss += sum((reward - state_value) ** 2 for reward in rewards)
-            count += len(rewards)
-            policy.v_function[board] += learning_rate * (sum(rewards) / len(rewards) - state_value)
-        mean_loss = loss / count
-        history.setdefault('loss', list()).append(mean_loss)
-        progress.set_postfix(loss=mean_loss)
+    with SelfplayPool(policy, workers) as pool:
+        for _ in progress:
+            batch_dataset, = pool.selfplay(play_v_games, game, batch_size)
+            loss, count = update_v(policy.v_function, batch_dataset, learning_rate, policy.init)
+            pool.updated(policy.v_function, batch_dataset)
+            mean_loss = loss / count
+            history.setdefault('loss', list()).append(mean_loss)
+            progress.set_postfix(loss=mean_loss)
     return history
 
 
-def q_policy_iteration(policy: tp.TabularQPolicy, game: Type[Context], selfplay_count, batch_size, learning_rate):
+def q_policy_iteration(policy: tp.TabularQPolicy, game: Type[Context], selfplay_count, batch_size, learning_rate,
+                       workers=1):
     batch_count = selfplay_count // batch_size
     history = dict()
     progress = tqdm(range(batch_count))
-    for _ in progress:
-        batch_dataset = dict()
-        for _ in range(batch_size):
-            context = game.new()
-            rollout = list()
-            while not context.done:
-                action, _ = policy(context)
-                rollout.append((context.board, action))
-                context = context(action)
-            for board, action in rollout:
-                batch_dataset.setdefault((board, action), list()).append(context.reward)
-        count = 0
-        loss = 0
-        for (board, action), rewards in batch_dataset.items():
-            action_rewards = policy.q_function[board]
-            loss += sum((reward - action_rewards[action]) ** 2 for reward in rewards)
-            count += len(rewards)
-            action_rewards[action] += learning_rate * (sum(rewards) / len(rewards) - action_rewards[action])
-            policy.q_function[board] = action_rewards
-        mean_loss = loss / count
-        history.setdefault('loss', list()).append(mean_loss)
-        progress.set_postfix(loss=mean_loss)
+    with SelfplayPool(policy, workers) as pool:
+        for _ in progress:
+            batch_dataset, = pool.selfplay(play_q_games, game, batch_size)
+            loss, count = update_q(policy.q_function, batch_dataset, learning_rate)
+            pool.updated(policy.q_function, {board for board, _ in batch_dataset})
+            mean_loss = loss / count
+            history.setdefault('loss', list()).append(mean_loss)
+            progress.set_postfix(loss=mean_loss)
     return history
 
 
 def direct_policy_iteration(policy: MCTSDefaultPolicy, game: Type[ContextTree],
-                            selfplay_count, batch_size, learning_rate):
+                            selfplay_count, batch_size, learning_rate, workers=1):
     assert isinstance(policy.default_policy, tp.TabularPiPolicy)
     batch_count = selfplay_count // batch_size
     history = dict()
     progress = tqdm(range(batch_count))
-    for _ in progress:
-        batch_dataset = dict()
-        for _ in range(batch_size):
-            context = game.new()
-            while not context.done:
-                action, _ = policy(context)
-                batch_dataset.setdefault(context.board, list()).append(action)
-                context = context(action)
-        count = 0
-        loss = 0
-        for board, actions in batch_dataset.items():
-            pi, scores = policy.default_policy.pi_function[board]
-            loss += -sum(math.log(pi[action]) for action in actions)
-            count += len(actions)
-            scores = [score - learning_rate * p for score, p in zip(scores, pi)]
-            for action in actions:
-                scores[action] += learning_rate / len(actions)
-            max_score = max(scores)
-            weights = [math.exp(score - max_score) for score in scores]
-            stat_sum = sum(weights)
-            pi = [weight / stat_sum for weight in weights]
-            policy.default_policy.pi_function[board] = pi, scores
-        mean_loss = loss / count
-        history.setdefault('loss', list()).append(mean_loss)
-        progress.set_postfix(loss=mean_loss)
+    with SelfplayPool(policy, workers) as pool:
+        for _ in progress:
+            _, batch_dataset = pool.selfplay(play_pi_games, game, batch_size)
+            loss, count = update_pi(policy.default_policy.pi_function, batch_dataset, learning_rate)
+            pool.updated(policy.default_policy.pi_function, batch_dataset)
+            mean_loss = loss / count
+            history.setdefault('loss', list()).append(mean_loss)
+            progress.set_postfix(loss=mean_loss)
     return history
 
 
-def puct_predictor_iteration(policy: tp.TabularPUCTPolicy, game: Type[ContextPredictor], selfplay_count, batch_size, learning_rate):
+def puct_predictor_iteration(policy: tp.TabularPUCTPolicy, game: Type[ContextPredictor], selfplay_count, batch_size, learning_rate,
+                             workers=1):
     batch_count = selfplay_count // batch_size
     history = dict()
     progress = tqdm(range(batch_count))
-    for _ in progress:
-        batch_v_dataset = dict()
-        batch_pi_dataset = dict()
-        for _ in range(batch_size):
-            context = game.new()
-            rollout = list()
-            while not context.done:
-                action, _ = policy(context)
-                batch_pi_dataset.setdefault(context.board, list()).append(action)
-                rollout.append(context.board)
-                context = context(action)
-            for board in rollout:
-                batch_v_dataset.setdefault(board, list()).append(context.reward)
-        pi_count = 0
-        pi_loss = 0
-        for board, actions in batch_pi_dataset.items():
-            pi, scores = policy.pi_function[board]
-            pi_loss += -sum(math.log(pi[action]) for action in actions)
-            pi_count += len(actions)
-            scores = [score - learning_rate * p for score, p in zip(scores, pi)]
-            for action in actions:
-                scores[action] += learning_rate / len(actions)
-            max_score = max(scores)
-            weights = [math.exp(score - max_score) for score in scores]
-            stat_sum = sum(weights)
-            pi = [weight / stat_sum for weight in weights]
-            policy.pi_function[board] = pi, scores
-        mean_pi_loss = pi_loss / pi_count
-        pi_size = len(policy.pi_function)
-        history.setdefault('pi_loss', list()).append(mean_pi_loss)
-        history.setdefault('pi_size', list()).append(pi_size)
-        progress.set_postfix(pi_loss=mean_pi_loss, pi_size=pi_size)
+    with SelfplayPool(policy, workers) as pool:
+        for _ in progress:
+            batch_v_dataset, batch_pi_dataset = pool.selfplay(play_pi_games, game, batch_size)
+            pi_loss, pi_count = update_pi(policy.pi_function, batch_pi_dataset, learning_rate)
+            pool.updated(policy.pi_function, batch_pi_dataset)
+            mean_pi_loss = pi_loss / pi_count
+            pi_size = len(policy.pi_function)
+            history.setdefault('pi_loss', list()).append(mean_pi_loss)
+            history.setdefault('pi_size', list()).append(pi_size)
+            progress.set_postfix(pi_loss=mean_pi_loss, pi_size=pi_size)
     return history
 
 
-def puct_v_iteration(policy: tp.TabularVTabularPUCTPolicy, game: Type[ContextPredictor], selfplay_count, batch_size, learning_rate):
+def puct_v_iteration(policy: tp.TabularVTabularPUCTPolicy, game: Type[ContextPredictor], selfplay_count, batch_size, learning_rate,
+                     workers=1):
     batch_count = selfplay_count // batch_size
     history = dict()
     progress = tqdm(range(batch_count))
-    for _ in progress:
-        batch_v_dataset = dict()
-        batch_pi_dataset = dict()
-        for _ in range(batch_size):
-            context = game.new()
-            rollout = list()
-            while not context.done:
-                action, _ = policy(context)
-                batch_pi_dataset.setdefault(context.board, list()).append(action)
-                rollout.append(context.board)
-                context = context(action)
-            for board in rollout:
-                batch_v_dataset.setdefault(board, list()).append(context.reward)
-        v_count = 0
-        v_loss = 0
-        for board, rewards in batch_v_dataset.items():
-            state_value = policy.v_function[board]
-            v_loss += sum((reward - state_value) ** 2 for reward in rewards)
-            v_count += len(rewards)
-            policy.v_function[board] += learning_rate * (sum(rewards) / len(rewards) - state_value)
-        pi_count = 0
-        pi_loss = 0
-        for board, actions in batch_pi_dataset.items():
-            pi, scores = policy.pi_function[board]
-            pi_loss += -sum(math.log(pi[action]) for action in actions)
-            pi_count += len(actions)
-            scores = [score - learning_rate * p for score, p in zip(scores, pi)]
-            for action in actions:
-                scores[action] += learning_rate / len(actions)
-            max_score = max(scores)
-            weights = [math.exp(score - max_score) for score in scores]
-            stat_sum = sum(weights)
-            pi = [weight / stat_sum for weight in weights]
-            policy.pi_function[board] = pi, scores
-        mean_v_loss = v_loss / v_count
-        mean_pi_loss = pi_loss / pi_count
-        v_size = len(policy.v_function)
-        pi_size = len(policy.pi_function)
-        history.setdefault('v_loss', list()).append(mean_v_loss)
-        history.setdefault('pi_loss', list()).append(mean_pi_loss)
-        history.setdefault('v_size', list()).append(v_size)
-        history.setdefault('pi_size', list()).append(pi_size)
-        progress.set_postfix(v_loss=mean_v_loss, pi_loss=mean_pi_loss, v_size=v_size, pi_size=pi_size)
+    with SelfplayPool(policy, workers) as pool:
+        for _ in progress:
+            batch_v_dataset, batch_pi_dataset = pool.selfplay(play_pi_games, game, batch_size)
+            v_loss, v_count = update_v(policy.v_function, batch_v_dataset, learning_rate)
+            pi_loss, pi_count = update_pi(policy.pi_function, batch_pi_dataset, learning_rate)
+            pool.updated(policy.v_function, batch_v_dataset)
+            pool.updated(policy.pi_function, batch_pi_dataset)
+            mean_v_loss = v_loss / v_count
+            mean_pi_loss = pi_loss / pi_count
+            v_size = len(policy.v_function)
+            pi_size = len(policy.pi_function)
+            history.setdefault('v_loss', list()).append(mean_v_loss)
+            history.setdefault('pi_loss', list()).append(mean_pi_loss)
+            history.setdefault('v_size', list()).append(v_size)
+            history.setdefault('pi_size', list()).append(pi_size)
+            progress.set_postfix(v_loss=mean_v_loss, pi_loss=mean_pi_loss, v_size=v_size, pi_size=pi_size)
     return history
@@ -0,0 +1,104 @@
+from array import array
+from collections import OrderedDict
+from typing import Type
+
+from contexts import Context
+from retrograde import enumerate_layers
+
+
+class TransitionCache:
+    """
+    Least recently used cache of transitions of a game class, mapping a board and an action to the next board
+    and its analysis, so a child reached again is created without `apply` and `analyze`. Set as `transitions`
+    of the game class, it is used by `Context.__call__` and `Context.next_board` of that class only, subclasses
+    ignore it. Children created from the cache share the list of actions, which must not be modified.
+    At most `capacity` transitions are kept.
+    """
+
+    def __init__(self, game: Type[Context], capacity=1000000):
+        self.game = game
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def entry(self, context: Context, action):
+        key = context.board, action
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            # the analysis is added when the child is created
+            entry = [context.apply(action), None]
+            self.entries[key] = entry
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return entry
+
+    def next_board(self, context: Context, action):
+        # afterstates are looked up without being added, applying the action is as cheap as adding it
+        entry = self.entries.get((context.board, action))
+        return context.apply(action) if entry is None else entry[0]
+
+    def child(self, context: Context, action):
+        entry = self.entry(context, action)
+        if entry[1] is None:
+            child = type(context)(entry[0], context.history + [action])
+            entry[1] = child.reward, child.done, child.move, child.actions
+            return child
+        return type(context)(entry[0], context.history + [action], entry[1])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class GameGraph:
+    """
+    Successor graph of all positions of a game played on a single board, enumerated breadth-first
+    as in retrograde analysis. Positions are numbered, `successors` is a flat array of 32-bit integers with
+    `num_actions` entries per position holding the number of the next position, or -1 for an illegal action,
+    and `analyses` holds the analysis of every position. Set as `transitions` of the game class, it creates
+    children by table lookups, like `TransitionCache` which never misses.
+    """
+
+    def __init__(self, game: Type[Context]):
+        if len(game.new().board) != 2:
+            raise ValueError(f'{game.__name__} is not played on a single board')
+        self.game = game
+        self.num_actions = game.num_actions()
+        self.boards = [board for layer in enumerate_layers(game) for board in layer]
+        self.index = {board: node for node, board in enumerate(self.boards)}
+        self.analyses = list()
+        self.successors = array('i', [-1]) * (len(self.boards) * self.num_actions)
+        for node, board in enumerate(self.boards):
+            context = game(board)
+            self.analyses.append((context.reward, context.done, context.move, context.actions))
+            for action in context.actions:
+                self.successors[node * self.num_actions + action] = self.index[context.apply(action)]
+
+    def successor(self, context: Context, action):
+        node = self.successors[self.index[context.board] * self.num_actions + action]
+        if node < 0:
+            raise ValueError(f'action {action} is not legal in the position')
+        return node
+
+    def next_board(self, context: Context, action):
+        return self.boards[self.successor(context, action)]
+
+    def child(self, context: Context, action):
+        node = self.successor(context, action)
+        return type(context)(self.boards[node], context.history + [action], self.analyses[node])
+
+    def __len__(self):
+        return len(self.boards)
+
+    @property
+    def nbytes(self):
+        return self.successors.itemsize * len(self.successors)
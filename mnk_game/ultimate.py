@@ -1,6 +1,6 @@
 from colorama import Fore, Style
 
-from contexts import ContextTree
+from contexts import BitActions, ContextTree
 from tictactoe import TicTacToe, MNKGame433, MNKGame444
 
 
@@ -15,46 +15,64 @@ class UltimateTicTacToe(TicTacToe):
     def num_actions(cls):
         return cls.NUM_ACTIONS * cls.NUM_ACTIONS
 
+    @classmethod
+    def position_key(cls, board, last_action):
+        # the last action determines the sub-board of the next move
+        return board, None if last_action is None else last_action % cls.NUM_ACTIONS
+
+    @classmethod
+    def sub_board_free(cls, sub_board_x, sub_board_o, sub_board_idx):
+        """
+        Free cells of the sub-board as a mask of actions.
+        """
+        return (~(sub_board_x | sub_board_o) & ((1 << cls.NUM_ACTIONS) - 1)) << sub_board_idx * cls.NUM_ACTIONS
+
     def calculate_actions(self):
         if self.history:
             sub_boards_x, sub_boards_o, super_board_x, super_board_o = self.board
             target_sub_board_idx = self.history[-1] % self.NUM_ACTIONS
-            super_board_mask = 2 ** target_sub_board_idx
-            if (super_board_x | super_board_o) & super_board_mask == super_board_mask:
-                available_sub_boards = [idx for idx, board in enumerate(self.to_bits(~(super_board_x | super_board_o))) if board == 1]
+            super_board = super_board_x | super_board_o
+            if super_board >> target_sub_board_idx & 1:
+                free = 0
+                for sub_board_idx in range(self.NUM_ACTIONS):
+                    if not super_board >> sub_board_idx & 1:
+                        free |= self.sub_board_free(sub_boards_x[sub_board_idx], sub_boards_o[sub_board_idx], sub_board_idx)
             else:
-                available_sub_boards = [target_sub_board_idx]
-            actions = list()
-            for sub_board_idx in available_sub_boards:
-                sub_board_free = self.to_bits(~(sub_boards_x[sub_board_idx] | sub_boards_o[sub_board_idx]))
-                actions += [idx + sub_board_idx * self.NUM_ACTIONS for idx, pos in enumerate(sub_board_free) if pos == 1]
-            return actions
+                free = self.sub_board_free(sub_boards_x[target_sub_board_idx], sub_boards_o[target_sub_board_idx],
+                                           target_sub_board_idx)
+            return BitActions(free)
         else:
             return list(range(self.num_actions()))
 
     def analyze(self):
         sub_boards_x, sub_boards_o, super_board_x, super_board_o = self.board
-        x_count = 0
-        for sub_board_x in sub_boards_x:
-            x_count += sum(self.to_bits(sub_board_x))
-            sub_reward_x, _ = self.calculate_reward(sub_board_x)
-        o_count = 0
-        for sub_board_o in sub_boards_o:
-            o_count += sum(self.to_bits(sub_board_o))
-            sub_reward_o, _ = self.calculate_reward(sub_board_o)
-
-        reward_x, _ = self.calculate_reward(super_board_x)
-        reward_o, _ = self.calculate_reward(super_board_o)
-        reward_o = -reward_o
-
-        if x_count == o_count and reward_x == 0:
-            move = self.X_MOVE
-            reward = reward_o
-        elif x_count == o_count + 1 and reward_o == 0:
-            move = self.O_MOVE
-            reward = reward_x
+
+        if self.history:
+            # the position before the last move was not final, so only the player of the last move can complete
+            # a line on the super-board, and only through the sub-board of the move
+            sub_board_idx, cell = divmod(self.history[-1], self.NUM_ACTIONS)
+            if sub_boards_x[sub_board_idx] >> cell & 1:
+                move = self.O_MOVE
+                reward, _ = self.calculate_last_reward(super_board_x, sub_board_idx)
+            else:
+                move = self.X_MOVE
+                reward, _ = self.calculate_last_reward(super_board_o, sub_board_idx)
+                reward = -reward
         else:
-            raise ValueError(self.board)
+            x_count = sum(sub_board_x.bit_count() for sub_board_x in sub_boards_x)
+            o_count = sum(sub_board_o.bit_count() for sub_board_o in sub_boards_o)
+            reward_x, _ = self.calculate_reward(super_board_x)
+            reward_o, _ = self.calculate_reward(super_board_o)
+            reward_o = -reward_o
+
+            if x_count == o_count and reward_x == 0:
+                move = self.X_MOVE
+                reward = reward_o
+            elif x_count == o_count + 1 and reward_o == 0:
+                move = self.O_MOVE
+                reward = reward_x
+            else:
+                raise ValueError(self.board)
 
         actions = self.calculate_actions() if reward == 0 else list()
         done = len(actions) == 0
@@ -71,7 +89,7 @@ class UltimateTicTacToe(TicTacToe):
             new_sub_boards_x = list(sub_boards_x)
             new_sub_boards_x[sub_board_idx] = sub_board_x
             if (super_board_x | super_board_o) & sub_board_mask == 0:
-                reward_x, _ = self.calculate_reward(sub_board_x)
+                reward_x, _ = self.calculate_last_reward(sub_board_x, action % self.NUM_ACTIONS)
                 super_board_x += reward_x * sub_board_mask
             return tuple(new_sub_boards_x), sub_boards_o, super_board_x, super_board_o
         else:
@@ -80,7 +98,7 @@ class UltimateTicTacToe(TicTacToe):
             new_sub_boards_o = list(sub_boards_o)
             new_sub_boards_o[sub_board_idx] = sub_board_o
             if (super_board_x | super_board_o) & sub_board_mask == 0:
-                reward_o, _ = self.calculate_reward(sub_board_o)
+                reward_o, _ = self.calculate_last_reward(sub_board_o, action % self.NUM_ACTIONS)
                 super_board_o += reward_o * sub_board_mask
             return sub_boards_x, tuple(new_sub_boards_o), super_board_x, super_board_o
 
@@ -135,9 +153,8 @@ class UltimateTicTacToeAlt(UltimateTicTacToe):
         if self.history:
             sub_boards_x, sub_boards_o, _, _ = self.board
             target_sub_board_idx = self.history[-1] % self.NUM_ACTIONS
-            sub_board_free = self.to_bits(~(sub_boards_x[target_sub_board_idx] | sub_boards_o[target_sub_board_idx]))
-            actions = [idx + target_sub_board_idx * self.NUM_ACTIONS for idx, pos in enumerate(sub_board_free) if pos == 1]
-            return actions
+            return BitActions(self.sub_board_free(sub_boards_x[target_sub_board_idx], sub_boards_o[target_sub_board_idx],
+                                                  target_sub_board_idx))
         else:
             return list(range(self.num_actions()))
 